@@ -3,22 +3,89 @@ from dotenv import load_dotenv
 import google.generativeai as genai
 import os
 import re
+import json
+from typing import List, TypedDict
 import pandas as pd
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import threading
+import logging
+from PIL import Image, features
 import uuid
 import io
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from contextlib import contextmanager
 from datetime import datetime
-from s3_utils import upload_visualization_to_s3
+from s3_utils import upload_visualization_to_s3, upload_visualizations_bulk
+from llm_service import get_gemini_model
 import numpy as np
 import seaborn as sns
+import sqlglot
+from sqlalchemy.pool import QueuePool
+from sqlglot import exp
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-def fetch_snowflake_response(query, year_quarter_dict):
+logger = logging.getLogger(__name__)
+# Shared by the query planner, column picker and summarizer
+_GEMINI = get_gemini_model("gemini-1.5-pro")
+
+# Plottable metric columns of NVIDIA_FIN_DATA. The key columns are always
+# fetched alongside them so the raw data can be placed on a time axis.
+METRIC_COLUMNS = [
+    'OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOLUME', 'DAILYCHANGE', 'DAILYCHANGEPERCENT',
+    'DOLLARVOLUME', 'MA10', 'MA30', 'VOLATILITY20D', 'RSI'
+]
+KEY_COLUMNS = ['DATE', 'YEAR', 'QUARTER']
+
+# Figures are created once and cleared between plots instead of going through
+# pyplot's global figure registry. They are shared, so drawing is serialized.
+_PLOT_LOCK = threading.Lock()
+_LINE_FIG = Figure(figsize=(12, 6), dpi=80)
+FigureCanvasAgg(_LINE_FIG)
+_LINE_AX = _LINE_FIG.add_subplot()
+_HEATMAP_FIG = Figure(figsize=(10, 8), dpi=80)
+FigureCanvasAgg(_HEATMAP_FIG)
+
+# Charts are uploaded as lossy WebP, or optimized PNG when this Pillow build
+# has no WebP support; CHART_EXTENSION also sets the S3 content type
+CHART_FORMAT = 'WEBP' if features.check('webp') else 'PNG'
+CHART_EXTENSION = '.webp' if CHART_FORMAT == 'WEBP' else '.png'
+
+def _encode_figure(fig):
+    """
+    Encode a figure from Agg's RGBA buffer in CHART_FORMAT. Charts are drawn on
+    an opaque background, so the alpha channel is dropped before encoding.
+    """
+    fig.canvas.draw()
+    buffer = io.BytesIO()
+    image = Image.fromarray(np.asarray(fig.canvas.buffer_rgba()), 'RGBA').convert('RGB')
+    if CHART_FORMAT == 'WEBP':
+        image.save(buffer, format='WEBP', quality=85, method=6)
+    else:
+        image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+# Where the agg_sql value starts in the streamed plan, and a pattern matching
+# (from there) the value once its JSON string has been fully streamed
+_AGG_SQL_KEY = '"agg_sql"'
+_AGG_SQL_RE = re.compile(r'"agg_sql"\s*:\s*("(?:[^"\\]|\\.)*")')
+# Fallback SQL extraction; [^;] cannot run past the delimiter, so no backtracking
+_SQL_RE = re.compile(r"(SELECT[^;]*);", re.IGNORECASE)
+
+class SnowflakeQueryPlan(TypedDict):
+    """Structured Gemini response for a Snowflake question."""
+    agg_sql: str
+    raw_sql: str
+    viz_columns: List[str]
 
-    GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
+def fetch_snowflake_response(query, year_quarter_dict, on_agg_sql=None):
 
     prompt = f"""
 
@@ -70,131 +137,218 @@ def fetch_snowflake_response(query, year_quarter_dict):
     - This query should retrieve individual record/records (financial metrics that is relevant to the user query, e.g., `(DOLLARVOLUME)`) along with date, year, quater without aggregation.
     - It should filter based on `Year` and `Quarter`.
 
+    ### **3. Visualization Columns**
+    - List the 3-4 metric columns from the table above that would best visualize the answer to the user's query.
+    - Do not include `DATE`, `TICKER`, `Year` or `Quarter`.
+
     **Format of Response:**
-    1. **Query 1: Aggregated Query**, followed by the SQL code.
-    2. **Query 2: Raw Data Query**, followed by the SQL code.
-    
-    - Ensure proper formatting and structuring of the queries.
-    - The explanation should follow after the SQL code, not between the queries.
+    Return a JSON object with these fields:
+    - `agg_sql`: the Aggregated Query.
+    - `raw_sql`: the Raw Data Query.
+    - `viz_columns`: the list of Visualization Columns.
 
 """
-    genai.configure(api_key=GOOGLE_API_KEY)
-    gemini_model = genai.GenerativeModel("gemini-1.5-pro")
-    response = gemini_model.generate_content(prompt)
-    # Call Gemini API (example, your logic here might differ)
-    #print(response.text)
-
-    return response.text.strip()
-
+    response = _GEMINI.generate_content(
+        prompt,
+        generation_config=genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=SnowflakeQueryPlan
+        ),
+        stream=True
+    )
 
-def fetch_snowflake_df(query):
-    # Snowflake connection details
-    SNOWFLAKE_ACCOUNT = os.getenv("SNOWFLAKE_ACCOUNT")
-    SNOWFLAKE_USER = os.getenv("SNOWFLAKE_USER")
-    SNOWFLAKE_PASSWORD = os.getenv("SNOWFLAKE_PASSWORD")
-    SNOWFLAKE_ROLE = os.getenv("SNOWFLAKE_ROLE")
-
-    # Connecting to Snowflake
-    conn = snowflake.connector.connect(
-        user=SNOWFLAKE_USER,
-        password=SNOWFLAKE_PASSWORD,
-        account=SNOWFLAKE_ACCOUNT,
-        role=SNOWFLAKE_ROLE
+    response_text = ""
+    agg_sql_sent = on_agg_sql is None
+    agg_key_pos = -1
+    for chunk in response:
+        if not chunk.parts:
+            continue
+        piece = chunk.text
+        response_text += piece
+        if agg_sql_sent:
+            continue
+        
+        # Hand the aggregated query off as soon as it is complete so it can
+        # run while the rest of the plan is still being generated. Only the new
+        # text is searched for the key, and the value is only re-matched from
+        # the key when a chunk could have closed it, so scanning stays linear.
+        if agg_key_pos < 0:
+            agg_key_pos = response_text.find(_AGG_SQL_KEY, max(0, len(response_text) - len(piece) - len(_AGG_SQL_KEY)))
+            if agg_key_pos < 0:
+                continue
+        elif '"' not in piece:
+            continue
+        match = _AGG_SQL_RE.match(response_text, agg_key_pos)
+        if match:
+            agg_sql_sent = True
+            agg_sql = json.loads(match.group(1)).strip().rstrip(";")
+            if agg_sql:
+                on_agg_sql(agg_sql)
+
+    return _parse_query_plan(response_text)
+
+def _parse_query_plan(response_text):
+    """Parse the query plan returned by Gemini, falling back to scraping SELECT statements."""
+    try:
+        plan = json.loads(response_text)
+    except json.JSONDecodeError:
+        print("Gemini response was not valid JSON, extracting SQL statements instead")
+        queries = _SQL_RE.findall(response_text)
+        plan = {
+            "agg_sql": queries[0] if len(queries) > 0 else "",
+            "raw_sql": queries[1] if len(queries) > 1 else "",
+            "viz_columns": []
+        }
+    
+    return {
+        "agg_sql": (plan.get("agg_sql") or "").strip().rstrip(";"),
+        "raw_sql": (plan.get("raw_sql") or "").strip().rstrip(";"),
+        "viz_columns": [str(col).strip().upper() for col in plan.get("viz_columns") or []]
+    }
+
+
+def _create_snowflake_connection():
+    """Open a Snowflake session with the NVIDIA database and schema selected."""
+    return snowflake.connector.connect(
+        user=os.getenv("SNOWFLAKE_USER"),
+        password=os.getenv("SNOWFLAKE_PASSWORD"),
+        account=os.getenv("SNOWFLAKE_ACCOUNT"),
+        role=os.getenv("SNOWFLAKE_ROLE"),
+        database="NVIDIA_DB",
+        schema="NVIDIA_SCHEMA",
+        client_session_keep_alive=True
     )
 
+# Reuse authenticated sessions across queries instead of logging in for each one
+_POOL = QueuePool(_create_snowflake_connection, pool_size=5, max_overflow=0, timeout=120, recycle=-1)
+
+@contextmanager
+def _pooled_cursor():
+    """Check a connection out of the pool and yield a cursor on it."""
+    conn = _POOL.connect()
     cur = conn.cursor()
-    cur.execute("USE DATABASE NVIDIA_DB;")
-    cur.execute("USE SCHEMA NVIDIA_DB.NVIDIA_SCHEMA;")
+    try:
+        yield cur
+    except snowflake.connector.errors.Error:
+        # The session may have expired or dropped; discard it instead of handing
+        # it to the next query. The pool opens a fresh one when it is needed.
+        conn.invalidate()
+        raise
+    finally:
+        try:
+            cur.close()
+        finally:
+            conn.close()  # Returns the connection to the pool (no-op once invalidated)
 
-    # Improved regex pattern to handle more SQL query formats
-    columns_pattern = re.search(r"SELECT\s+([\w\s,.*()]+?)\s+FROM", query, re.IGNORECASE | re.MULTILINE)
-    
+def fetch_snowflake_df(query):
     try:
-        # Execute the query first to get actual column names
-        cur.execute(query)
-        results = cur.fetchall()
-        
-        # Get column names from cursor description (this is more reliable)
-        column_names = [col[0] for col in cur.description]
-        
-        # Create DataFrame with the correct column names
-        df = pd.DataFrame(results, columns=column_names)
-        return df
+        with _pooled_cursor() as cur:
+            # Build the DataFrame straight from the Arrow result batches
+            cur.execute(query)
+            df = cur.fetch_pandas_all()
+    except Exception:
+        logger.exception("Error executing raw query: %s", query)
+        raise
+    
+    # Parse dates once here so the plotting code can use them as-is
+    if 'DATE' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['DATE']):
+        df['DATE'] = pd.to_datetime(df['DATE'], errors='coerce')
+    return df
 
-    except Exception as e:
-        print(f"Error executing query: {e}")
-        return pd.DataFrame()  # Return empty DataFrame on error
-    finally:
-        cur.close()
-        conn.close()
+def fetch_snowflake_records(query):
+    """Run a small (aggregated) query and return its rows as a list of dicts.
 
-def create_and_save_graph(df, query, timestamp, metadata_filters=None):
+    The aggregated result is only ever serialized into the summary prompt, so
+    building a DataFrame for it would be thrown away immediately.
+    """
+    try:
+        with _pooled_cursor() as cur:
+            cur.execute(query)
+            columns = [col[0] for col in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+    except Exception:
+        logger.exception("Error executing aggregated query: %s", query)
+        raise
+
+def project_sql(sql, keep_cols):
+    """
+    Narrow a plain `SELECT *` over a single table to keep_cols, so only the
+    plotted columns are fetched. Explicit column lists already say what the
+    query needs and are left alone, as are DISTINCT, aggregated, joined and
+    unparseable queries, whose rows would change with the SELECT list.
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read="snowflake")
+    except sqlglot.errors.ParseError as e:
+        print(f"Could not parse query for projection, running it unchanged: {e}")
+        return sql
+    
+    if not isinstance(tree, exp.Select) or any(tree.args.get(arg) for arg in ("distinct", "group", "joins")):
+        return sql
+    
+    # Only an unqualified star is rewritten; qualified stars and mixed lists are left as they are
+    projections = tree.expressions
+    if len(projections) != 1 or not isinstance(projections[0], exp.Star):
+        return sql
+    
+    return tree.select(*keep_cols, append=False).sql(dialect="snowflake")
+
+def create_and_save_graph(df, query, timestamp, metadata_filters=None, relevant_columns=None):
     """Create focused visualizations based on query relevance."""
     try:
-        # Ensure 'Date' column is properly formatted
-        df['Date'] = pd.to_datetime(df['DATE'])
-        
-        # Get relevant columns with fallback options
-        relevant_columns = get_relevant_columns(query, df.columns, metadata_filters)
+        # Get relevant columns with fallback options, unless the caller already picked them
+        if relevant_columns is None:
+            relevant_columns = get_relevant_columns(query, df.columns, metadata_filters)
+        relevant_columns = [col for col in relevant_columns if col in df.columns]
         
         # Create visualization folder path with timestamp
         viz_folder = f"visualizations/temp/query_{timestamp}"
         
-        visualizations = []
-        
-        # 1. Create time series plot for main metrics
-        plt.figure(figsize=(12, 6))
-        for col in relevant_columns[:3]:  # Limit to top 3 most relevant metrics
-            plt.plot(df['Date'], df[col], label=col)
-        plt.xlabel('Date')
-        plt.ylabel('Value')
-        plt.title(f'NVIDIA Key Metrics: {", ".join(relevant_columns[:3])}')
-        plt.legend()
-        plt.grid(True)
-        
-        # Save and upload time series plot
-        buffer1 = io.BytesIO()
-        plt.savefig(buffer1, format='png')
-        buffer1.seek(0)
-        plt.close()
+        # Charts are rendered lazily, so each one uploads while the next is drawn
+        charts = []
         
-        ts_url = upload_visualization_to_s3(
-            image_data=buffer1.getvalue(),
-            prefix=f"{viz_folder}/time_series",
-            filename="time_series.png"
-        )
-        
-        visualizations.append({
-            "url": ts_url,
-            "type": "time_series",
-            "title": "Key Metrics Time Series",
-            "columns": relevant_columns[:3]
-        })
-        
-        # 2. Create correlation heatmap if we have multiple relevant columns
-        if len(relevant_columns) > 1:
-            plt.figure(figsize=(10, 8))
-            correlation = df[relevant_columns].corr()
-            sns.heatmap(correlation, annot=True, cmap='coolwarm', center=0)
-            plt.title('Correlation between Key Metrics')
-            
-            buffer2 = io.BytesIO()
-            plt.savefig(buffer2, format='png')
-            buffer2.seek(0)
-            plt.close()
-            
-            corr_url = upload_visualization_to_s3(
-                image_data=buffer2.getvalue(),
-                prefix=f"{viz_folder}/correlation",
-                filename="correlation.png"
-            )
+        def render_charts():
+            # 1. Create time series plot for main metrics
+            with _PLOT_LOCK:
+                _LINE_AX.clear()
+                for col in relevant_columns[:3]:  # Limit to top 3 most relevant metrics
+                    _LINE_AX.plot(df['DATE'], df[col], label=col)
+                _LINE_AX.set_xlabel('Date')
+                _LINE_AX.set_ylabel('Value')
+                _LINE_AX.set_title(f'NVIDIA Key Metrics: {", ".join(relevant_columns[:3])}')
+                _LINE_AX.legend()
+                _LINE_AX.grid(True)
+                
+                # Save time series plot
+                ts_image = _encode_figure(_LINE_FIG)
             
-            visualizations.append({
-                "url": corr_url,
-                "type": "correlation",
-                "title": "Metrics Correlation Analysis",
-                "columns": relevant_columns
+            charts.append({
+                "type": "time_series",
+                "title": "Key Metrics Time Series",
+                "columns": relevant_columns[:3]
             })
+            yield ts_image, f"{viz_folder}/time_series", f"time_series{CHART_EXTENSION}"
+            
+            # 2. Create correlation heatmap if there are enough columns and rows for it to be meaningful
+            if len(relevant_columns) >= 3 and len(df) >= 10:
+                correlation = df[relevant_columns].corr()
+                with _PLOT_LOCK:
+                    # The heatmap adds its own colorbar axes, so start from an empty figure
+                    _HEATMAP_FIG.clear()
+                    heatmap_ax = _HEATMAP_FIG.add_subplot()
+                    sns.heatmap(correlation, annot=True, cmap='coolwarm', center=0, ax=heatmap_ax)
+                    heatmap_ax.set_title('Correlation between Key Metrics')
+                    corr_image = _encode_figure(_HEATMAP_FIG)
+                
+                charts.append({
+                    "type": "correlation",
+                    "title": "Metrics Correlation Analysis",
+                    "columns": relevant_columns
+                })
+                yield corr_image, f"{viz_folder}/correlation", f"correlation{CHART_EXTENSION}"
+        
+        urls = upload_visualizations_bulk(render_charts(), max_workers=2)
+        visualizations = [{"url": url, **viz} for url, viz in zip(urls, charts)]
         
         return visualizations
         
@@ -204,20 +358,24 @@ def create_and_save_graph(df, query, timestamp, metadata_filters=None):
 
 def get_relevant_columns(query, available_columns, metadata_filters=None):
     """Use LLM to identify relevant columns for visualization with fallback."""
+    # Repeated queries against the same schema reuse the earlier LLM answer
+    return list(_cached_relevant_columns(query.strip().lower(), frozenset(available_columns)))
+
+@lru_cache(maxsize=1024)
+def _cached_relevant_columns(query, available_columns):
+    """Cached body of get_relevant_columns, keyed on the normalized query and column set."""
     prompt = f"""
     Given this query about NVIDIA financial data:
     "{query}"
     
     And these available columns:
-    {[col for col in available_columns if col not in ['DATE', 'Date', 'Year', 'Quarter']]}
+    {sorted(col for col in available_columns if col not in ['DATE', 'Date', 'Year', 'Quarter'])}
     
     List only the 3-4 most relevant column names that would best answer this query.
     Return only the column names separated by commas, nothing else.
     """
     
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    gemini_model = genai.GenerativeModel("gemini-1.5-pro")
-    response = gemini_model.generate_content(prompt)
+    response = _GEMINI.generate_content(prompt)
     
     # Extract column names and clean them
     columns = [col.strip() for col in response.text.split(',')]
@@ -226,67 +384,72 @@ def get_relevant_columns(query, available_columns, metadata_filters=None):
     # If no relevant columns found or columns don't make sense for the query,
     # use default visualization columns based on time period
     if not relevant_cols or all(col in ['Year', 'Quarter', 'DATE'] for col in relevant_cols):
-        print("No specific columns identified from query, using default visualization columns")
-        
-        # Default visualization set 1: Price and Volume trends
-        price_cols = ['HIGH', 'LOW', 'CLOSE', 'DOLLARVOLUME']
-        # Default visualization set 2: Technical indicators
-        tech_cols = ['MA10', 'MA30', 'RSI', 'VOLATILITY20D']
-        
-        # Check which columns are available and use them
-        available_price_cols = [col for col in price_cols if col in available_columns]
-        available_tech_cols = [col for col in tech_cols if col in available_columns]
-        
-        # Use price columns as primary fallback
-        if available_price_cols:
-            relevant_cols = available_price_cols[:3]  # Limit to 3 columns
-            print(f"Using default price-based columns: {relevant_cols}")
-        # Use technical indicators as secondary fallback
-        elif available_tech_cols:
-            relevant_cols = available_tech_cols[:3]
-            print(f"Using default technical indicator columns: {relevant_cols}")
+        relevant_cols = default_visualization_columns(available_columns)
     
-    return relevant_cols
-
-year_quarter_dict = {
-    "2024": ["1", "2", "3"],
-    "2023": ["2", "4"]
-}
-
-query = "What is the MA10 value for a specific stock (TICKER) on a given date?"
-
-input_string = fetch_snowflake_response(query,year_quarter_dict)
+    return tuple(relevant_cols)
 
-queries = re.findall(r"(SELECT[\s\S]*?);", input_string)
-
-# Store the queries in variables
-agg_query = queries[0] if len(queries) > 0 else None
-raw_query = queries[1] if len(queries) > 1 else None
-
-#fetch_snowflake_df(agg_query)
-dataframe = fetch_snowflake_df(raw_query)
-create_and_save_graph(dataframe, query, datetime.now().strftime('%Y%m%d%H%M%S'))
+def default_visualization_columns(available_columns):
+    """Pick default visualization columns without calling the LLM."""
+    print("No specific columns identified from query, using default visualization columns")
+    relevant_cols = []
+    
+    # Default visualization set 1: Price and Volume trends
+    price_cols = ['HIGH', 'LOW', 'CLOSE', 'DOLLARVOLUME']
+    # Default visualization set 2: Technical indicators
+    tech_cols = ['MA10', 'MA30', 'RSI', 'VOLATILITY20D']
+    
+    # Check which columns are available and use them
+    available_price_cols = [col for col in price_cols if col in available_columns]
+    available_tech_cols = [col for col in tech_cols if col in available_columns]
+    
+    # Use price columns as primary fallback
+    if available_price_cols:
+        relevant_cols = available_price_cols[:3]  # Limit to 3 columns
+        print(f"Using default price-based columns: {relevant_cols}")
+    # Use technical indicators as secondary fallback
+    elif available_tech_cols:
+        relevant_cols = available_tech_cols[:3]
+        print(f"Using default technical indicator columns: {relevant_cols}")
+    
+    return relevant_cols
 
 def generate_snowflake_insights(query, year_quarter_dict):
     """Main function to generate insights from Snowflake data."""
     try:
-        # Get SQL queries based on user question
-        llm_response = fetch_snowflake_response(query, year_quarter_dict)
-        queries = re.findall(r"(SELECT[\s\S]*?);", llm_response)
-        
-        # Extract queries
-        agg_query = queries[0] if len(queries) > 0 else None
-        raw_query = queries[1] if len(queries) > 1 else None
-        
-        # Execute queries and get data
-        agg_df = fetch_snowflake_df(agg_query) if agg_query else None
-        raw_df = fetch_snowflake_df(raw_query) if raw_query else None
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Get SQL queries and visualization columns based on user question. The
+            # aggregated query starts running as soon as Gemini has streamed it.
+            agg_futures = []
+            query_plan = fetch_snowflake_response(
+                query,
+                year_quarter_dict,
+                on_agg_sql=lambda sql: agg_futures.append(executor.submit(fetch_snowflake_records, sql))
+            )
+            agg_query = query_plan["agg_sql"] or None
+            raw_query = query_plan["raw_sql"] or None
+            if agg_query and not agg_futures:
+                agg_futures.append(executor.submit(fetch_snowflake_records, agg_query))
+            
+            # The table schema is fixed, so the visualization columns are known before
+            # any data is fetched and a SELECT * raw query only fetches what will be plotted
+            viz_columns = [col for col in query_plan["viz_columns"] if col in METRIC_COLUMNS]
+            if not viz_columns:
+                viz_columns = default_visualization_columns(METRIC_COLUMNS)
+            if raw_query:
+                raw_query = project_sql(raw_query, KEY_COLUMNS + viz_columns)
+            
+            # Both queries run concurrently, each on its own pooled connection
+            raw_future = executor.submit(fetch_snowflake_df, raw_query) if raw_query else None
+            agg_records = agg_futures[0].result() if agg_futures else []
+            raw_df = raw_future.result() if raw_future else None
         
-        # Generate visualization if we have raw data
+        # Generate visualization if we have enough raw data to plot; a handful of
+        # rows or no metric columns (e.g. a single-value lookup) is not worth a chart
         visualizations = []
-        if raw_df is not None and not raw_df.empty:
+        has_metrics = raw_df is not None and raw_df.drop(columns=KEY_COLUMNS, errors='ignore').select_dtypes(include='number').shape[1] > 0
+        if has_metrics and len(raw_df) >= 3:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            visualizations = create_and_save_graph(raw_df, query, timestamp)
+            visualizations = create_and_save_graph(raw_df, query, timestamp, relevant_columns=viz_columns)
             
             print("\n" + "="*80)
             print("🖼️ VISUALIZATION DEBUG")
@@ -301,7 +464,7 @@ def generate_snowflake_insights(query, year_quarter_dict):
             print("="*80 + "\n")
         
         # Generate summary of the data
-        summary = generate_data_summary(query, agg_df, raw_df)
+        summary = generate_data_summary(query, agg_records, raw_df)
         
         result = {
             "summary": summary,
@@ -323,7 +486,8 @@ def generate_snowflake_insights(query, year_quarter_dict):
         return {
             "summary": f"Error generating insights: {str(e)}",
             "visualizations": [],
-            "raw_data": []
+            "raw_data": [],
+            "error": True
         }
 
 def create_intelligent_visualizations(df, query):
@@ -338,13 +502,9 @@ def create_intelligent_visualizations(df, query):
     query_terms = set(query.lower().split())
     
     # Identify numeric columns that aren't DATE, Year, or Quarter
-    numeric_cols = df.select_dtypes(include=['float64', 'int64']).columns.tolist()
+    numeric_cols = df.select_dtypes(include='number').columns.tolist()
     numeric_cols = [col for col in numeric_cols if col not in ['Year', 'Quarter']]
     
-    # Ensure 'DATE' column is datetime
-    if 'DATE' in df.columns:
-        df['DATE'] = pd.to_datetime(df['DATE'])
-    
     # Find columns that match query terms (prioritize these)
     relevant_cols = []
     for col in numeric_cols:
@@ -357,31 +517,32 @@ def create_intelligent_visualizations(df, query):
     
     # Group columns by scale to avoid plotting issues
     if len(relevant_cols) > 1:
-        # Calculate mean values for each column to determine scale
-        col_means = {col: df[col].mean() for col in relevant_cols}
+        # Calculate mean values for all columns in one reduction to determine scale
+        abs_means = np.abs(df[relevant_cols].mean().to_numpy(dtype=float))
         
-        # Group columns by order of magnitude
-        scale_groups = {}
-        for col, mean in col_means.items():
-            if mean == 0:
-                magnitude = 0
-            else:
-                magnitude = int(np.log10(abs(mean)))
-            
-            if magnitude not in scale_groups:
-                scale_groups[magnitude] = []
-            scale_groups[magnitude].append(col)
+        # Group columns by order of magnitude (zero or missing means go in group 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            magnitudes = np.where(np.isfinite(abs_means) & (abs_means > 0), np.floor(np.log10(abs_means)), 0).astype(int)
+        scale_groups = defaultdict(list)
+        for col, magnitude in zip(relevant_cols, magnitudes):
+            scale_groups[int(magnitude)].append(col)
         
-        # Create separate visualizations for each scale group
-        for magnitude, cols in scale_groups.items():
-            if cols:
-                viz_url = create_and_upload_visualization(df, cols, f"magnitude_{magnitude}")
-                viz_urls.append({
-                    "url": viz_url,
-                    "type": "line_chart",
-                    "title": f"Metrics with similar scale (10^{magnitude})",
-                    "columns": cols
-                })
+        # Create separate visualizations for each scale group, uploading each
+        # chart while the next one is drawn
+        groups = [(magnitude, cols) for magnitude, cols in scale_groups.items() if cols]
+        urls = upload_visualizations_bulk(
+            (
+                (_render_metrics_chart(df, cols), f"nvidia_magnitude_{magnitude}", f"magnitude_{magnitude}{CHART_EXTENSION}")
+                for magnitude, cols in groups
+            ),
+            max_workers=min(4, len(groups))
+        )
+        viz_urls.extend({
+            "url": url,
+            "type": "line_chart",
+            "title": f"Metrics with similar scale (10^{magnitude})",
+            "columns": cols
+        } for url, (magnitude, cols) in zip(urls, groups))
     else:
         # Just one column, create a single visualization
         viz_url = create_and_upload_visualization(df, relevant_cols, "single_metric")
@@ -396,9 +557,10 @@ def create_intelligent_visualizations(df, query):
 
 def create_and_upload_visualization(df, columns, chart_type):
     """Create visualization and upload to S3, returning the URL."""
-    # Create the plot
-    plt.figure(figsize=(10, 6))
-    
+    return _upload_metrics_chart(_render_metrics_chart(df, columns), chart_type)
+
+def _render_metrics_chart(df, columns):
+    """Draw the given columns as a line chart and return the encoded image bytes."""
     # If we have date column, use it for x-axis
     if 'DATE' in df.columns:
         x_column = 'DATE'
@@ -406,49 +568,48 @@ def create_and_upload_visualization(df, columns, chart_type):
         # Use the first available index
         x_column = df.index
     
-    # Plot each selected column
-    for column in columns:
-        plt.plot(df[x_column], df[column], label=column)
-    
-    # Add chart elements
-    plt.xlabel('Date')
-    plt.ylabel('Value')
-    plt.title(f'NVIDIA Financial Metrics: {", ".join(columns)}')
-    plt.legend()
-    plt.grid(True)
-    
-    # Save to buffer
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    plt.close()
-    
+    with _PLOT_LOCK:
+        _LINE_AX.clear()
+        
+        # Plot each selected column
+        for column in columns:
+            _LINE_AX.plot(df[x_column], df[column], label=column)
+        
+        # Add chart elements
+        _LINE_AX.set_xlabel('Date')
+        _LINE_AX.set_ylabel('Value')
+        _LINE_AX.set_title(f'NVIDIA Financial Metrics: {", ".join(columns)}')
+        _LINE_AX.legend()
+        _LINE_AX.grid(True)
+        
+        # Save to buffer
+        return _encode_figure(_LINE_FIG)
+
+def _upload_metrics_chart(image_data, chart_type):
+    """Upload a rendered metrics chart to S3, returning the presigned URL."""
     # Use the specialized function to upload and get URL
     viz_prefix = f"nvidia_{chart_type}"
     presigned_url = upload_visualization_to_s3(
-        image_data=buffer.getvalue(),
-        prefix=viz_prefix
+        image_data=image_data,
+        prefix=viz_prefix,
+        filename=f"{chart_type}{CHART_EXTENSION}"
     )
     
     return presigned_url
 
-def generate_data_summary(query, agg_df, raw_df):
+def generate_data_summary(query, agg_records, raw_df):
     """Generate a text summary of the data based on query and results."""
     # Prepare data for summarization
-    agg_data = agg_df.to_dict(orient="records") if agg_df is not None else []
+    agg_data = agg_records or []
     sample_data = raw_df.head(5).to_dict(orient="records") if raw_df is not None else []
     
     # Describe the data's statistical properties
     stats = {}
     if raw_df is not None:
-        numeric_cols = raw_df.select_dtypes(include=['float64', 'int64']).columns
-        for col in numeric_cols:
-            stats[col] = {
-                "min": raw_df[col].min(),
-                "max": raw_df[col].max(),
-                "avg": raw_df[col].mean(),
-                "median": raw_df[col].median()
-            }
+        # One aggregation over the metric columns instead of four reductions per column
+        numeric_df = raw_df.drop(columns=['YEAR', 'QUARTER', 'Year', 'Quarter'], errors='ignore').select_dtypes(include='number')
+        if not numeric_df.columns.empty:
+            stats = numeric_df.agg(['min', 'max', 'mean', 'median']).rename(index={'mean': 'avg'}).to_dict()
     
     # Create a prompt for the LLM to summarize the data
     prompt = f"""
@@ -468,8 +629,25 @@ def generate_data_summary(query, agg_df, raw_df):
     """
     
     # Get summary from Gemini
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    gemini_model = genai.GenerativeModel("gemini-1.5-pro")
-    response = gemini_model.generate_content(prompt)
+    response = _GEMINI.generate_content(prompt)
     
     return response.text.strip()
+
+if __name__ == "__main__":
+    # Example run
+    year_quarter_dict = {
+        "2024": ["1", "2", "3"],
+        "2023": ["2", "4"]
+    }
+
+    query = "What is the MA10 value for a specific stock (TICKER) on a given date?"
+
+    query_plan = fetch_snowflake_response(query,year_quarter_dict)
+
+    # Store the queries in variables
+    agg_query = query_plan["agg_sql"] or None
+    raw_query = query_plan["raw_sql"] or None
+
+    #fetch_snowflake_df(agg_query)
+    dataframe = fetch_snowflake_df(raw_query)
+    create_and_save_graph(dataframe, query, datetime.now().strftime('%Y%m%d%H%M%S'))
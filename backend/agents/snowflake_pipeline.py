@@ -1,16 +1,16 @@
 import yfinance as yf
 from dotenv import load_dotenv
 from pathlib import Path
-import numpy as np
 import io
 import snowflake.connector
 import os
+import s3_utils
 
 load_dotenv()
 
 def create_daily_historical_report(ticker="NVDA", period="5y", output_file=None):
     """
-    Create a report with daily historical data and technical indicators
+    Create a report with raw daily historical (OHLCV) data
     """
     print(f"🔍 Fetching daily historical data for {ticker} over {period}...")
     
@@ -34,61 +34,10 @@ def create_daily_historical_report(ticker="NVDA", period="5y", output_file=None)
         # Add ticker column as the first column
         df.insert(0, 'Ticker', ticker)
         
-        # Some additional calculated columns that change daily
-        if 'Close' in df.columns and 'Open' in df.columns:
-            df['DailyChange'] = df['Close'] - df['Open']
-            df['DailyChangePercent'] = (df['Close'] / df['Open'] - 1) * 100
-        
-        if 'Volume' in df.columns and 'Close' in df.columns:
-            df['DollarVolume'] = df['Volume'] * df['Close']
-        
-        # Calculate 10-day and 30-day moving averages
-        # Handle NaN values for initial periods by filling with the value itself
-        if 'Close' in df.columns:
-            df['MA10'] = df['Close'].rolling(window=10, min_periods=1).mean()
-            df['MA30'] = df['Close'].rolling(window=30, min_periods=1).mean()
-        
-        # Calculate volatility (standard deviation of returns over 20 days)
-        if 'Close' in df.columns:
-            # Calculate returns first
-            df['Returns'] = df['Close'].pct_change()
-            
-            # Handle initial NaN value in Returns
-            df['Returns'] = df['Returns'].fillna(0)
-            
-            # Calculate volatility with min_periods=1 to handle initial values
-            df['Volatility20D'] = df['Returns'].rolling(window=20, min_periods=1).std() * (252 ** 0.5)
-        
-        # Calculate Relative Strength Index (RSI)
-        if 'Close' in df.columns:
-            delta = df['Close'].diff()
-            # Handle initial NaN value
-            delta = delta.fillna(0)
-            
-            up = delta.clip(lower=0)
-            down = -1 * delta.clip(upper=0)
-            
-            # Instead of ewm which produces initial NaNs, use rolling with expanding
-            # for the initial periods
-            up_mean = up.rolling(window=14, min_periods=1).mean()
-            down_mean = down.rolling(window=14, min_periods=1).mean()
-            
-            # Avoid division by zero
-            down_mean = down_mean.replace(0, np.finfo(float).eps)
-            
-            rs = up_mean / down_mean
-            df['RSI'] = 100 - (100 / (1 + rs))
-        
-        # Remove intermediate calculation columns
-        if 'Returns' in df.columns:
-            df = df.drop('Returns', axis=1)
-        
-        # Remove Dividends and Stock Splits columns if they exist
-        if 'Dividends' in df.columns:
-            df = df.drop('Dividends', axis=1)
-        
-        if 'Stock Splits' in df.columns:
-            df = df.drop('Stock Splits', axis=1)
+        # Only raw OHLCV is loaded; daily change, dollar volume and the technical
+        # indicators are computed in Snowflake by the NVIDIA_FIN_DATA view.
+        # Remove Dividends and Stock Splits columns if they exist, in one pass
+        df.drop(columns=['Dividends', 'Stock Splits'], errors='ignore', inplace=True)
         
         # Save to CSV
         df.to_csv(output_file, index=False)
@@ -107,16 +56,16 @@ def create_daily_historical_report(ticker="NVDA", period="5y", output_file=None)
         return None
 
 def upload_csv_to_s3(df):
-    # Convert DataFrame to CSV in memory (without index)
-    output_buffer = io.StringIO()
-    df.to_csv(output_buffer, index=False)
-    output_buffer.seek(0)  # Go to the beginning of the StringIO object
+    # Write the gzipped CSV straight into a binary buffer (without index)
+    output_buffer = io.BytesIO()
+    df.to_csv(output_buffer, index=False, compression='gzip')
+    output_buffer.seek(0)  # Go to the beginning of the BytesIO object
 
     # Generate the filename with timestamp
-    filename = f"nvidia_data.csv"
+    filename = f"nvidia_data.csv.gz"
 
-    # Upload the CSV to S3
-    s3_utils.upload_file_to_s3(output_buffer.getvalue(), filename, "csvFile")
+    # Upload the buffer as a file object, without copying it into a bytes value
+    s3_utils.upload_file_to_s3(output_buffer, filename, "csvFile")
 
     print("File uploaded to s3")
 
@@ -176,6 +125,7 @@ def snowflake_connector():
             CREATE OR REPLACE FILE FORMAT NVIDIA_CSV_FORMAT
             TYPE = 'CSV'
             FIELD_OPTIONALLY_ENCLOSED_BY = '"'
+            COMPRESSION = 'GZIP'
             SKIP_HEADER = 1; -- Ensures the first row is treated as column headers
 
         """)
@@ -189,35 +139,65 @@ def snowflake_connector():
             FILE_FORMAT = (FORMAT_NAME = 'NVIDIA_CSV_FORMAT');
         """)
 
-    # Create Table by Inferring Schema
+    # Create the raw price table loaded from S3
     def create_table(cur):
         cur.execute("""
-            CREATE OR REPLACE TABLE NVIDIA_FIN_DATA (
+            CREATE OR REPLACE TABLE NVIDIA_RAW (
                 Ticker STRING,
                 Date TIMESTAMP,
                 Open FLOAT,
                 High FLOAT,
                 Low FLOAT,
                 Close FLOAT,
-                Volume INT,
-                DailyChange FLOAT,
-                DailyChangePercent FLOAT,
-                DollarVolume FLOAT,
-                MA10 FLOAT,
-                MA30 FLOAT,
-                Volatility20D FLOAT,
-                RSI FLOAT,
-                Year INT, 
-                Quarter INT
+                Volume INT
             );
         """)
 
+    # Derive the daily metrics and technical indicators with window functions.
+    # Windows match the old pandas rolling(..., min_periods=1) computation.
+    def create_view(cur):
+        cur.execute("""
+            CREATE OR REPLACE VIEW NVIDIA_FIN_DATA AS
+            WITH BASE AS (
+                SELECT
+                    *,
+                    Close / LAG(Close) OVER (PARTITION BY Ticker ORDER BY Date) - 1 AS Return1D,
+                    Close - LAG(Close, 1, Close) OVER (PARTITION BY Ticker ORDER BY Date) AS Delta
+                FROM NVIDIA_RAW
+            ),
+            GAINS AS (
+                SELECT
+                    *,
+                    AVG(GREATEST(Delta, 0)) OVER (PARTITION BY Ticker ORDER BY Date ROWS BETWEEN 13 PRECEDING AND CURRENT ROW) AS UpMean,
+                    AVG(GREATEST(-Delta, 0)) OVER (PARTITION BY Ticker ORDER BY Date ROWS BETWEEN 13 PRECEDING AND CURRENT ROW) AS DownMean
+                FROM BASE
+            )
+            SELECT
+                Ticker,
+                Date,
+                Open,
+                High,
+                Low,
+                Close,
+                Volume,
+                Close - Open AS DailyChange,
+                (Close / Open - 1) * 100 AS DailyChangePercent,
+                Volume * Close AS DollarVolume,
+                AVG(Close) OVER (PARTITION BY Ticker ORDER BY Date ROWS BETWEEN 9 PRECEDING AND CURRENT ROW) AS MA10,
+                AVG(Close) OVER (PARTITION BY Ticker ORDER BY Date ROWS BETWEEN 29 PRECEDING AND CURRENT ROW) AS MA30,
+                STDDEV_SAMP(COALESCE(Return1D, 0)) OVER (PARTITION BY Ticker ORDER BY Date ROWS BETWEEN 19 PRECEDING AND CURRENT ROW) * SQRT(252) AS Volatility20D,
+                100 - 100 / (1 + UpMean / GREATEST(DownMean, 2.220446049250313e-16)) AS RSI, -- avoid division by zero
+                YEAR(Date) AS Year,
+                QUARTER(Date) AS Quarter
+            FROM GAINS;
+        """)
+
     # Load Data into Snowflake Table from Stage
     def load_data_into_snowflake(cur):
         cur.execute("""
-            COPY INTO NVIDIA_FIN_DATA
+            COPY INTO NVIDIA_RAW
             FROM @NVIDIA_STAGE
-            FILES = ('nvidia_data.csv')
+            FILES = ('nvidia_data.csv.gz')
             FILE_FORMAT = (FORMAT_NAME = 'NVIDIA_CSV_FORMAT')
         """)
 
@@ -227,6 +207,7 @@ def snowflake_connector():
     create_stage(cur)
     create_table(cur)
     load_data_into_snowflake(cur)
+    create_view(cur)
 
     conn.commit()
     cur.close()
@@ -238,11 +219,6 @@ def snowflake_connector():
 # Example usage
 if __name__ == "__main__":
     df = create_daily_historical_report("NVDA", "5y")
-    # Create 'year' column by extracting the year from 'Date'
-    df['Year'] = df['Date'].dt.year
-
-    # Create 'quarter' column by extracting the quarter from 'Date'
-    df['Quarter'] = df['Date'].dt.quarter
     print(len(df), type(df), df.columns)
     upload_csv_to_s3(df)
     snowflake_connector()
@@ -1,23 +1,87 @@
 from typing import Dict, List, Any
-from serpapi import GoogleSearch
+import httpx
+import ijson
 import os
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
+import asyncio
+import threading
+from cachetools import TTLCache
 from llm_service import generate_response_with_gemini  # Add this import
 
 # Load environment variables
 load_dotenv()
 SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY")
 
+# Searches are limited to the last month, so results a few minutes old are still
+# current. Repeated queries skip SerpAPI (billed per call) and the Gemini synthesis.
+_SEARCH_CACHE = TTLCache(maxsize=512, ttl=600)
+_SYNTHESIS_CACHE = TTLCache(maxsize=256, ttl=600)
+_CACHE_LOCK = threading.Lock()
+
+def _cache_get(cache, key):
+    with _CACHE_LOCK:
+        return cache.get(key)
+
+def _cache_set(cache, key, value):
+    with _CACHE_LOCK:
+        cache[key] = value
+
+SERPAPI_SEARCH_URL = "https://serpapi.com/search.json"
+
+_SERP_CLIENT = None
+
+def _get_serp_client():
+    """
+    One pooled keep-alive async client for the whole process, so searches reuse the
+    TLS connection to SerpAPI. It is created on first use so that, like the async
+    Gemini client, it binds to the server's event loop.
+    """
+    global _SERP_CLIENT
+    if _SERP_CLIENT is None:
+        _SERP_CLIENT = httpx.AsyncClient(http2=True, timeout=10.0, limits=httpx.Limits(max_keepalive_connections=10))
+    return _SERP_CLIENT
+
+class _ByteStream:
+    """Minimal async file-like wrapper so ijson can read a streamed httpx response."""
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def read(self, size=-1):
+        # ijson probes the stream type with read(0), which must not consume a chunk
+        if size == 0:
+            return b""
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+
+async def _stream_serpapi_items(search_params, prefix):
+    """
+    Yield the items of one result array (e.g. "news_results.item") from SerpAPI,
+    without building the rest of the response (ads, related searches, pagination...)
+    """
+    async with _get_serp_client().stream("GET", SERPAPI_SEARCH_URL, params=search_params) as response:
+        response.raise_for_status()
+        # use_float skips building Decimal objects for the numeric fields
+        async for item in ijson.items(_ByteStream(response.aiter_bytes()), prefix, use_float=True):
+            yield item
+
 class WebSearchAgent:
     def __init__(self):
         self.api_key = SERPAPI_API_KEY
         
-    def search_news(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
+    async def search_news(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Search for recent news articles about NVIDIA
         """
         print(f"Searching for news articles about {query}")
+        cache_key = ("news", query.lower().strip(), num_results)
+        cached = _cache_get(_SEARCH_CACHE, cache_key)
+        if cached is not None:
+            print("Using cached news results")
+            return cached
+        
         try:
             nvidia_query = f"NVIDIA {query}"
             search_params = {
@@ -29,32 +93,38 @@ class WebSearchAgent:
                 "tbs": "qdr:m",  # Last month's results
                 "location": "United States"
             }
-            search = GoogleSearch(search_params)
-            results = search.get_dict()
             
+            # All results of one search share the time they were retrieved
+            retrieved_at = datetime.now(timezone.utc).isoformat()
             formatted_results = []
-            if "news_results" in results:
-                for item in results["news_results"]:
-                    formatted_results.append({
-                        "type": "news",
-                        "title": item.get("title", ""),
-                        "link": item.get("link", ""),
-                        "snippet": item.get("snippet", ""),
-                        "source": item.get("source", ""),
-                        "date": item.get("date", ""),
-                        "timestamp": datetime.now().isoformat()
-                    })
+            async for item in _stream_serpapi_items(search_params, "news_results.item"):
+                formatted_results.append({
+                    "type": "news",
+                    "title": item.get("title", ""),
+                    "link": item.get("link", ""),
+                    "snippet": item.get("snippet", ""),
+                    "source": item.get("source", ""),
+                    "date": item.get("date", ""),
+                    "timestamp": retrieved_at
+                })
             
+            _cache_set(_SEARCH_CACHE, cache_key, formatted_results)
             return formatted_results
             
         except Exception as e:
             print(f"Error in news search: {str(e)}")
             return []
 
-    def search_trends(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
+    async def search_trends(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Search for general trends and articles about NVIDIA
         """
+        cache_key = ("trends", query.lower().strip(), num_results)
+        cached = _cache_get(_SEARCH_CACHE, cache_key)
+        if cached is not None:
+            print("Using cached trend results")
+            return cached
+        
         try:
             nvidia_query = f"NVIDIA {query} trends analysis research"
             search_params = {
@@ -65,22 +135,21 @@ class WebSearchAgent:
                 "tbs": "qdr:m"  # Last month's results
             }
             
-            search = GoogleSearch(search_params)
-            results = search.get_dict()
-            
+            # All results of one search share the time they were retrieved
+            retrieved_at = datetime.now(timezone.utc).isoformat()
             formatted_results = []
-            if "organic_results" in results:
-                for item in results["organic_results"]:
-                    formatted_results.append({
-                        "type": "trend",
-                        "title": item.get("title", ""),
-                        "link": item.get("link", ""),
-                        "snippet": item.get("snippet", ""),
-                        "source": item.get("source", "website"),
-                        "date": item.get("date", "Recent"),
-                        "timestamp": datetime.now().isoformat()
-                    })
+            async for item in _stream_serpapi_items(search_params, "organic_results.item"):
+                formatted_results.append({
+                    "type": "trend",
+                    "title": item.get("title", ""),
+                    "link": item.get("link", ""),
+                    "snippet": item.get("snippet", ""),
+                    "source": item.get("source", "website"),
+                    "date": item.get("date", "Recent"),
+                    "timestamp": retrieved_at
+                })
             
+            _cache_set(_SEARCH_CACHE, cache_key, formatted_results)
             return formatted_results
             
         except Exception as e:
@@ -94,50 +163,64 @@ class WebSearchAgent:
         if not news_results and not trend_results:
             return "No relevant results found."
             
-        summary = "NVIDIA Market Intelligence Report:\n\n"
+        parts = ["NVIDIA Market Intelligence Report:\n\n"]
         
         # Process News Section
         if news_results:
-            summary += "📰 Latest News:\n" + "="*50 + "\n"
+            parts.append("📰 Latest News:\n" + "="*50 + "\n")
             for i, result in enumerate(news_results, 1):
-                summary += f"{i}. {result['title']}\n"
-                summary += f"   📅 {result['date']} | 🔍 {result['source']}\n"
-                summary += f"   {result['snippet']}\n"
-                summary += f"   🔗 {result['link']}\n\n"
+                parts.append(
+                    f"{i}. {result['title']}\n"
+                    f"   📅 {result['date']} | 🔍 {result['source']}\n"
+                    f"   {result['snippet']}\n"
+                    f"   🔗 {result['link']}\n\n"
+                )
         
         # Process Trends Section
         if trend_results:
-            summary += "\n📈 Market Trends & Analysis:\n" + "="*50 + "\n"
+            parts.append("\n📈 Market Trends & Analysis:\n" + "="*50 + "\n")
             for i, result in enumerate(trend_results, 1):
-                summary += f"{i}. {result['title']}\n"
-                summary += f"   💡 Key Points: {result['snippet']}\n"
-                summary += f"   🔗 {result['link']}\n\n"
+                parts.append(
+                    f"{i}. {result['title']}\n"
+                    f"   💡 Key Points: {result['snippet']}\n"
+                    f"   🔗 {result['link']}\n\n"
+                )
         
         # Add timestamp
-        summary += f"\n🕒 Report generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        parts.append(f"\n🕒 Report generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
         
-        return summary
+        return "".join(parts)
 
-    def synthesize_results(self, news_results: List[Dict], trend_results: List[Dict]) -> str:
+    async def synthesize_results(self, news_results: List[Dict], trend_results: List[Dict]) -> str:
         """
         Create an analytical summary using Gemini based on news and trend snippets
         """
+        # The analysis only depends on the fields that go into the context
+        cache_key = (
+            tuple((item['title'], item['date'], item['source'], item['snippet']) for item in news_results),
+            tuple((item['title'], item['snippet']) for item in trend_results)
+        )
+        cached = _cache_get(_SYNTHESIS_CACHE, cache_key)
+        if cached is not None:
+            print("Using cached web search analysis")
+            return cached
+        
         # Prepare context from news and trends
-        news_context = "\n".join([
+        news_context = "\n".join(
             f"NEWS ARTICLE:\n"
             f"Title: {item['title']}\n"
             f"Date: {item['date']}\n"
             f"Source: {item['source']}\n"
             f"Summary: {item['snippet']}\n"
             for item in news_results
-        ])
+        )
 
-        trends_context = "\n".join([
+        trends_context = "\n".join(
             f"MARKET TREND:\n"
             f"Title: {item['title']}\n"
             f"Summary: {item['snippet']}\n"
             for item in trend_results
-        ])
+        )
 
         context = f"""
         RECENT NEWS AND TRENDS ABOUT NVIDIA:
@@ -150,33 +233,36 @@ class WebSearchAgent:
 
         print("web search context: ", context)
         # Use the new response_type parameter
-        analysis, token_info = generate_response_with_gemini(
+        analysis, token_info = await generate_response_with_gemini(
             query="Analyze NVIDIA updates",
             context=context,
             response_type="web_analysis"
         )
         print("web search analysis: ", analysis)
+        # generate_response_with_gemini reports failures as (error text, None)
+        if token_info is not None:
+            _cache_set(_SYNTHESIS_CACHE, cache_key, (analysis, token_info))
         return analysis, token_info  # Now also returning token info for tracking
 
-    def run(self, query: str) -> Dict[str, Any]:
+    async def run(self, query: str) -> Dict[str, Any]:
         """
-        Modified run method to include synthesis
+        Modified run method to include synthesis. The plain-text report from
+        process_results is not built here; callers format raw_results themselves.
         """
         try:
-            # Perform searches
-            news_results = self.search_news(query)
-            trend_results = self.search_trends(query)
+            # Perform both searches concurrently; they are independent SerpAPI
+            # requests on the shared async client
+            news_results, trend_results = await asyncio.gather(
+                self.search_news(query),
+                self.search_trends(query)
+            )
             print("news_results: ", news_results)
             print("trend_results: ", trend_results)
-            # Generate basic summary
-            summary = self.process_results(news_results, trend_results)
-            
             # Generate analytical insights
-            insights, token_info = self.synthesize_results(news_results, trend_results)
+            insights, token_info = await self.synthesize_results(news_results, trend_results)
             
             return {
                 "status": "success",
-                "summary": summary,
                 "insights": insights,  # New synthesized analysis
                 "token_info": token_info,
                 "raw_results": {
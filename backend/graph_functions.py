@@ -1,117 +1,57 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
 from state import AgentAction
-import os
+import logging
 from dotenv import load_dotenv
-from pinecone_db import AgenticResearchAssistant
+from pinecone_db import get_research_assistant
+from llm_service import GOOGLE_API_KEY
 from agents.web_search_agent import WebSearchAgent
 from agents.snowflake_agent import generate_snowflake_insights
-import re
+import asyncio
+from functools import lru_cache
 load_dotenv()
-# Initialize the LLM
-api_key = os.getenv("GOOGLE_API_KEY")
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=api_key)
+logger = logging.getLogger(__name__)
+
+# Initialize the LLM with the same key llm_service configured the Gemini SDK with
+llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=GOOGLE_API_KEY)
+
+# The search clients are created on first use and shared by every graph run.
+# The research assistant comes from pinecone_db.get_research_assistant, which the
+# API endpoints share too, so the embedding model is only loaded once.
+@lru_cache(maxsize=None)
+def _get_web_search_agent():
+    return WebSearchAgent()
+
+# Tool the oracle picks for each research mode; combined mode queries all
+# three sources at once through the combined_fanout node
+MODE_TOOLS = {
+    "pinecone": "pinecone",
+    "web_search": "web_search",
+    "snowflake": "snowflake",
+    "combined": "combined"
+}
+
+# Graph node that handles each tool chosen by the oracle
+TOOL_NODES = {
+    "pinecone": "rag_search",
+    "web_search": "web_search",
+    "snowflake": "snowflake_search",
+    "combined": "combined_fanout",
+    "final_answer": "final_answer"
+}
 
 def run_oracle(state):
     """
-    Decides which tool to use based on the query and selected mode.
+    Decides which tool to use based on the selected mode.
     """
-    print("\n" + "="*80)
-    print("🔮 ORACLE NODE: Deciding which tool to use")
-    print("="*80)
-    print(f"Query: \"{state['input']}\"")
-    print(f"Mode: {state.get('mode')}")
-    
-    # Get list of tools we've already used
-    used_tools = [step.tool for step in state.get("intermediate_steps", [])]
-    print(f"Tools used so far: {used_tools}")
-    
-    # For specific modes, respect the user's choice
-    if state.get("mode") in ["pinecone", "web_search", "snowflake"]:
-        if not used_tools:
-            chosen_tool = state.get("mode")
-        else:
-            chosen_tool = "final_answer"
+    logger.debug("Oracle node: deciding which tool to use")
+    logger.debug("Query: %r, mode: %s", state['input'], state.get('mode'))
     
-    # For combined mode
-    elif state.get("mode") == "combined":
-        all_tools = {"web_search", "pinecone", "snowflake"}
-        used_real_tools = {tool for tool in used_tools if tool in all_tools}
-        
-        if not used_tools:
-            # First tool selection via LLM
-            oracle_prompt = ChatPromptTemplate.from_template(
-                """You are an intelligent assistant that decides which tool to use first to answer a user's query about NVIDIA.
-                
-                Available tools:
-                - pinecone: Search NVIDIA quarterly reports and financial data (use for historical financial analysis, earnings, revenue, etc.)
-                - web_search: Search recent news and web content (use for current events, market updates, new products, etc.)
-                - snowflake: Query financial metrics and stock performance data (use for stock performance, technical indicators, price trends)
-                
-                The user's query is: {input}
-                
-                Consider:
-                1. Which data source would be most relevant to start with?
-                2. For financial history and earnings, use pinecone
-                3. For recent events and news, use web_search
-                4. For stock performance and metrics, use snowflake
-                
-                Reply with just one tool name: "pinecone", "web_search", or "snowflake"."""
-            )
-            
-            chosen_tool = llm.invoke(
-                oracle_prompt.format(input=state["input"])
-            ).content.strip().lower()
-            print(f"LLM chose initial tool: {chosen_tool}")
-            
-        elif len(used_real_tools) < 3:
-            # Use remaining tools in a strategic order
-            unused_tools = all_tools - used_real_tools
-            print(f"Unused tools: {unused_tools}")
-            
-            # Let LLM choose from remaining tools
-            next_tool_prompt = ChatPromptTemplate.from_template(
-                """Based on the query: "{input}"
-                And having already used these tools: {used_tools}
-                Which of these remaining tools would be most valuable next: {unused_tools}?
-                
-                Consider:
-                1. What information gaps still exist
-                2. Which tool would best complement our current data
-                3. How to build a comprehensive answer
-                
-                Reply with just one tool name from the unused tools."""
-            )
-            
-            chosen_tool = llm.invoke(
-                next_tool_prompt.format(
-                    input=state["input"],
-                    used_tools=list(used_real_tools),
-                    unused_tools=list(unused_tools)
-                )
-            ).content.strip().lower()
-            
-            # Validate chosen tool is unused
-            if chosen_tool not in unused_tools:
-                chosen_tool = next(iter(unused_tools))
-            
-            print(f"Selected next tool: {chosen_tool}")
-        else:
-            print("All tools used - generating final answer")
-            chosen_tool = "final_answer"
-    
-    # Normalize the response
-    if "pinecone" in chosen_tool:
-        chosen_tool = "pinecone"
-    elif "web" in chosen_tool:
-        chosen_tool = "web_search"
-    elif "snow" in chosen_tool:
-        chosen_tool = "snowflake"
-    else:
-        chosen_tool = "final_answer"
+    # Every mode runs its tool(s) exactly once and then answers, so the whole
+    # route is fixed by the mode and planned here in a single lookup
+    chosen_tool = MODE_TOOLS.get(state.get("mode"), "final_answer")
     
-    print(f"🎯 ORACLE DECISION: {chosen_tool}")
-    print("="*80 + "\n")
+    logger.debug("Oracle decision: %s", chosen_tool)
     
     # Create the agent action
     action = AgentAction(
@@ -129,188 +69,168 @@ def router(state):
     """
     Routes to the next node based on the chosen tool.
     """
-    print("\n" + "-"*80)
-    print("🧭 ROUTER: Determining next node")
-    print("-"*80)
     
     # Get the most recent action's tool
     if isinstance(state["intermediate_steps"], list) and state["intermediate_steps"]:
         latest_tool = state["intermediate_steps"][-1].tool
-        print(f"Latest tool selected: {latest_tool}")
-        
-        # Map tools to nodes
-        tool_to_node = {
-            "pinecone": "rag_search",
-            "web_search": "web_search",
-            "snowflake": "snowflake_search",
-            "final_answer": "final_answer"
-        }
         
         # Get the next node
-        next_node = tool_to_node.get(latest_tool)
-        print(f"🚀 ROUTING TO: {next_node}")
-        print("-"*80 + "\n")
+        next_node = TOOL_NODES.get(latest_tool)
+        logger.debug("Routing %s to %s", latest_tool, next_node)
         return next_node
     else:
         # Default to final_answer if no steps or invalid format
-        print("No valid steps found - defaulting to final_answer")
-        print("-"*80 + "\n")
+        logger.debug("No valid steps found - defaulting to final_answer")
         return "final_answer"
 
 def rag_search(state):
     """
     Execute the Pinecone RAG search.
     """
-    print("\n" + "="*80)
-    print("📚 PINECONE RAG SEARCH NODE: Searching financial reports")
-    print("="*80)
+    logger.debug("Pinecone RAG search node: searching financial reports")
     
     # Get the tool input from the last intermediate step
     tool_input = state["intermediate_steps"][-1].tool_input
     
+    # Update the intermediate steps
+    new_action = _run_rag_search(tool_input)
+    return {"intermediate_steps": state["intermediate_steps"] + [new_action], "rag_result": new_action.log}
+
+def _run_rag_search(tool_input):
+    """Search Pinecone for the given tool input and wrap the result in an AgentAction."""
     # Extract the query and metadata filters from the tool input
     query = tool_input.get("query", "")
     metadata_filters = tool_input.get("metadata_filters", {})
     
-    print(f"Query: \"{query}\"")
-    print(f"Filters: {metadata_filters}")
+    logger.debug("Query: %r", query)
+    logger.debug("Filters: %s", metadata_filters)
     
     # Call the search function directly (no tool wrapper)
-    research_assistant = AgenticResearchAssistant()
+    research_assistant = get_research_assistant()
+    error = False
     try:
         result = research_assistant.search_pinecone_db(
             query=query,
             year_quarter_dict=metadata_filters,
             top_k=20
         )
-        print(f"✅ Pinecone search completed successfully")
-        print(f"Result preview (first 200 chars): {str(result)[:200]}...")
+        logger.debug("Pinecone search completed, preview: %.200s", result)
     except Exception as e:
-        print(f"❌ Error in rag_search: {e}")
+        logger.error("Error in rag_search: %s", e)
         result = f"Error searching Pinecone: {str(e)}"
+        error = True
     
-    print("="*80 + "\n")
     
     # Create a new action with the result
-    new_action = AgentAction(
+    return AgentAction(
         tool="rag_search_result",
         tool_input=tool_input,
-        log=str(result)
+        log=str(result),
+        metadata={"error": error}
     )
-    
-    # Update the intermediate steps
-    return {"intermediate_steps": state["intermediate_steps"] + [new_action]}
 
-def web_search(state):
+async def web_search(state):
     """
     Execute the web search.
     """
-    print("\n" + "="*80)
-    print("🌐 WEB SEARCH NODE: Searching for recent information")
-    print("="*80)
+    logger.debug("Web search node: searching for recent information")
     
     tool_input = state["intermediate_steps"][-1].tool_input
+    
+    new_action = await _run_web_search(tool_input)
+    return {
+        "intermediate_steps": state["intermediate_steps"] + [new_action],
+        "web_result": new_action.log,
+        "web_links": new_action.metadata.get("links", [])
+    }
+
+async def _run_web_search(tool_input):
+    """Search the web for the given tool input and wrap the result in an AgentAction."""
     query = tool_input.get("query", "")
-    print(f"Query: \"{query}\"")
+    logger.debug("Query: %r", query)
     
-    web_search_agent = WebSearchAgent()
+    web_links = []
+    error = False
+    web_search_agent = _get_web_search_agent()
     try:
         # Use run instead of search_news to get both news and trends with links
-        search_results = web_search_agent.run(query)
+        search_results = await web_search_agent.run(query)
         
         if search_results["status"] == "error":
             result = f"Error in web search: {search_results['error']}"
-            print("❌ Web search error:", result)
+            logger.error("Web search error: %s", result)
+            error = True
         else:
-            # Format results into readable text with clickable links
-            formatted_result = "### Recent News and Analysis\n\n"
+            # Format results into readable text, linking each title once; the
+            # source names stay plain text so URLs are not repeated in the prompt
+            parts = ["### Recent News and Analysis\n\n"]
             
             # Add news section with clickable links
             if search_results["raw_results"]["news"]:
-                formatted_result += "#### 📰 Latest News\n\n"
+                parts.append("#### 📰 Latest News\n\n")
                 for i, item in enumerate(search_results["raw_results"]["news"], 1):
-                    formatted_result += f"**{i}. [{item['title']}]({item['link']})**\n"
-                    formatted_result += f"📅 {item['date']} | 🔗 [{item['source']}]({item['link']})\n"
-                    formatted_result += f"Summary: {item['snippet']}\n\n"
+                    parts.append(
+                        f"**{i}. [{item['title']}]({item['link']})**\n"
+                        f"📅 {item['date']} | 🔗 {item['source']}\n"
+                        f"Summary: {item['snippet']}\n\n"
+                    )
             
             # Add trends section with clickable links
             if search_results["raw_results"]["trends"]:
-                formatted_result += "#### 📈 Market Trends & Analysis\n\n"
+                parts.append("#### 📈 Market Trends & Analysis\n\n")
                 for i, item in enumerate(search_results["raw_results"]["trends"], 1):
-                    formatted_result += f"**{i}. [{item['title']}]({item['link']})**\n"
-                    formatted_result += f"Source: [{item['source']}]({item['link']})\n"
-                    formatted_result += f"Key Points: {item['snippet']}\n\n"
+                    parts.append(
+                        f"**{i}. [{item['title']}]({item['link']})**\n"
+                        f"Source: {item['source']}\n"
+                        f"Key Points: {item['snippet']}\n\n"
+                    )
+            
+            # The synthesis reports a Gemini failure as its text, with no token info
+            error = search_results.get("token_info") is None
             
             # Add insights section
             if search_results.get("insights"):
-                formatted_result += "#### 🔍 Analysis\n\n"
-                formatted_result += f"{search_results['insights']}\n\n"
+                parts.append(f"#### 🔍 Analysis\n\n{search_results['insights']}\n\n")
             
-            result = formatted_result
-            print(f"✅ Web search completed successfully")
-            print(f"Result preview (first 200 chars): {result[:200]}...")
+            result = "".join(parts)
+            
+            # Keep the source links as data for the final answer's references
+            web_links = [
+                {"title": item['title'], "url": item['link']}
+                for item in search_results["raw_results"]["news"] + search_results["raw_results"]["trends"]
+                if item['link']
+            ]
+            logger.debug("Web search completed, preview: %.200s", result)
             
     except Exception as e:
-        print(f"❌ Error in web_search: {e}")
+        logger.error("Error in web_search: %s", e)
         result = f"Error searching web: {str(e)}"
+        error = True
     
-    print("="*80 + "\n")
     
-    return {"intermediate_steps": state["intermediate_steps"] + [
-        AgentAction(
-            tool="web_search_result",
-            tool_input=tool_input,
-            log=str(result)
-        )
-    ]}
+    return AgentAction(
+        tool="web_search_result",
+        tool_input=tool_input,
+        log=str(result),
+        metadata={"links": web_links, "error": error}
+    )
 
-def generate_final_answer(state):
+def generate_final_answer(state, config: RunnableConfig = None):
     """
     Generate a comprehensive final answer based on collected information.
     """
-    print("\n" + "="*80)
-    print("🏁 FINAL ANSWER NODE: Generating comprehensive response")
-    print("="*80)
-    
-    # Extract results from intermediate steps
-    rag_result = ""
-    web_result = ""
-    snowflake_result = ""
-    visualization_urls = []  # Store visualization URLs
-    web_links = []  # Store web search links
-    
-    for step in state["intermediate_steps"]:
-        if step.tool == "rag_search_result":
-            rag_result = step.log
-            print("✓ Found Pinecone RAG search results")
-        elif step.tool == "web_search_result":
-            web_result = step.log
-            print("✓ Found Web search results")
-            
-            # Extract web links before sending to LLM
-            news_links = re.findall(r'\[(.*?)\]\((https?://[^\s\)]+)\)', web_result)
-            web_links.extend([{
-                "title": title,
-                "url": url
-            } for title, url in news_links])
-            print(f"Extracted {len(news_links)} web links")
-            
-        elif step.tool == "snowflake_search_result":
-            snowflake_result = step.log
-            print("✓ Found Snowflake search results")
-            
-            # Extract visualization URLs from Snowflake markdown
-            if "## Visualizations" in snowflake_result:
-                viz_section = snowflake_result.split("## Visualizations")[1]
-                viz_blocks = re.findall(r'!\[(.*?)\]\((.*?)\)\n\n\*(.*?)\*', viz_section)
-                visualization_urls.extend([{
-                    "title": title,
-                    "url": url,
-                    "caption": caption
-                } for title, url, caption in viz_blocks])
-                snowflake_result = snowflake_result.split("## Visualizations")[0]
-    
-    print(f"Found {len(visualization_urls)} visualizations and {len(web_links)} web links")
+    logger.debug("Final answer node: generating comprehensive response")
+    
+    # Each search node stores its result in its own state field (the Snowflake
+    # one without its chart markdown, which is appended after the LLM answer)
+    rag_result = state.get("rag_result", "")
+    web_result = state.get("web_result", "")
+    snowflake_result = state.get("snowflake_result", "")
+    # Links and charts were kept as structured data by the search nodes
+    visualization_urls = state.get("visualizations", [])
+    web_links = state.get("web_links", [])
+    
+    logger.debug("Found %d visualizations and %d web links", len(visualization_urls), len(web_links))
     
     # Generate prompt based on available results
     mode = state.get("mode", "combined")
@@ -434,38 +354,38 @@ def generate_final_answer(state):
         Focus on analyzing the data and insights while maintaining all source links.
         """
     
-    # Generate the final answer
-    print("Generating final response with LLM...")
-    response = llm.invoke(prompt)
+    # Generate the final answer. Streaming lets graph.astream(stream_mode="messages")
+    # callers (see stream_research_graph) receive the tokens as they arrive. The node
+    # config carries LangGraph's stream callbacks; it is passed on explicitly because
+    # Python < 3.11 does not propagate it to the executor thread through contextvars.
+    logger.debug("Generating final response with LLM")
+    response_text = "".join(chunk.content for chunk in llm.stream(prompt, config))
     
     # Construct the final response with preserved visualizations and web links
-    final_response = response.content
+    parts = [response_text]
     
     # Add web links section if we have any
     if web_links:
-        final_response += "\n\n## Sources and References\n\n"
-        for link in web_links:
-            final_response += f"- [{link['title']}]({link['url']})\n"
+        parts.append("\n\n## Sources and References\n\n")
+        parts.extend(f"- [{link['title']}]({link['url']})\n" for link in web_links)
     
     # Add visualizations section if we have any
     if visualization_urls:
-        final_response += "\n\n## Visualizations\n\n"
-        for viz in visualization_urls:
-            final_response += f"![{viz['title']}]({viz['url']})\n\n"
-            final_response += f"*{viz['caption']}*\n\n"
+        parts.append("\n\n## Visualizations\n\n")
+        parts.extend(f"![{viz['title']}]({viz['url']})\n\n*{viz['caption']}*\n\n" for viz in visualization_urls)
     
-    # Create a new action with the result
+    final_response = "".join(parts)
+    
+    # Create a new action with the result. The appendix is kept separately so a
+    # streaming caller can send it after the tokens without repeating the answer.
     new_action = AgentAction(
         tool="final_answer_result",
         tool_input={"query": query},
-        log=final_response
+        log=final_response,
+        metadata={"appendix": "".join(parts[1:])}
     )
     
-    print("✅ Final answer generated successfully")
-    print(f"Number of visualizations preserved: {len(visualization_urls)}")
-    print(f"Number of web links preserved: {len(web_links)}")
-    print(f"Result preview (first 200 chars): {final_response[:200]}...")
-    print("="*80 + "\n")
+    logger.debug("Final answer generated, preview: %.200s", final_response)
     
     return {
         "output": final_response,
@@ -479,28 +399,32 @@ def snowflake_search(state):
     # Get the tool input from the last intermediate step
     tool_input = state["intermediate_steps"][-1].tool_input
     
-    print(f"Running snowflake_search with input: {tool_input}")
+    new_action = _run_snowflake_search(tool_input)
+    return {
+        "intermediate_steps": state["intermediate_steps"] + [new_action],
+        "snowflake_result": new_action.metadata.get("text", new_action.log),
+        "visualizations": new_action.metadata.get("visualizations", [])
+    }
+
+def _run_snowflake_search(tool_input):
+    """Query Snowflake for the given tool input and wrap the result in an AgentAction."""
     
     # Extract the query and metadata filters from the tool input
     query = tool_input.get("query", "")
     metadata_filters = tool_input.get("metadata_filters", {})
     
-    print(f"Searching Snowflake with query={query}, filters={metadata_filters}")
+    logger.debug("Searching Snowflake with query=%r, filters=%s", query, metadata_filters)
     
     try:
         # Call the Snowflake insights function
         result = generate_snowflake_insights(query, metadata_filters)
-        print(f"Result: {result}")
+        logger.debug("Snowflake result: %s", result)
         # Format the response for LangGraph with proper markdown
         formatted_result = {
             "text": f"## Financial Data Analysis\n\n{result['summary']}\n\n",
             "visualizations": result['visualizations']
         }
         
-        print("\n" + "="*80)
-        print("🔄 LANGGRAPH VISUALIZATION FORMATTING")
-        print("="*80)
-        print("Converting to markdown format...")
         
         # Convert to markdown string with proper image syntax
         markdown_result = formatted_result["text"]
@@ -511,29 +435,67 @@ def snowflake_search(state):
                 caption_markdown = f"*{viz['title']} - {', '.join(viz['columns'])}*\n\n"
                 markdown_result += image_markdown + caption_markdown
                 
-                print("\nAdded visualization to markdown:")
-                print("Image markdown:", image_markdown.strip())
-                print("Caption markdown:", caption_markdown.strip())
+                logger.debug("Added visualization to markdown: %s", image_markdown.strip())
         
-        print("\nFinal markdown result preview:")
-        print("-"*40)
-        print(markdown_result[-5000:], "...")
-        print("="*80 + "\n")
+        logger.debug("Snowflake markdown result: %s", markdown_result)
         
         new_action = AgentAction(
             tool="snowflake_search_result",
             tool_input=tool_input,
-            log=markdown_result
+            log=markdown_result,
+            # The analysis text alone goes into the final-answer prompt
+            metadata={"text": formatted_result["text"], "visualizations": [{
+                "title": viz['title'],
+                "url": viz['url'],
+                "caption": f"{viz['title']} - {', '.join(viz['columns'])}"
+            } for viz in result['visualizations']], "error": result.get("error", False)}
         )
         
     except Exception as e:
-        print(f"Error in snowflake_search: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in snowflake_search: %s", e)
         new_action = AgentAction(
             tool="snowflake_search_result",
             tool_input=tool_input,
-            log=f"Error searching Snowflake: {str(e)}"
+            log=f"Error searching Snowflake: {str(e)}",
+            metadata={"error": True}
         )
     
-    return {"intermediate_steps": state["intermediate_steps"] + [new_action]}
+    return new_action
+
+def _error_action(tool, tool_input, error):
+    """Wrap an exception raised by one fanout branch in an AgentAction."""
+    logger.error("Error in %s: %s", tool, error)
+    return AgentAction(tool=tool, tool_input=tool_input, log=f"Error in {tool}: {str(error)}", metadata={"error": True})
+
+async def combined_fanout(state):
+    """
+    Query Pinecone, the web and Snowflake concurrently for combined mode.
+    """
+    logger.debug("Combined fanout node: querying all data sources in parallel")
+    
+    tool_input = state["intermediate_steps"][-1].tool_input
+    
+    # The three sources are independent I/O-bound calls, so run them side by side;
+    # the synchronous Pinecone and Snowflake searches each get a worker thread.
+    # A failing source must not discard the other two results.
+    results = await asyncio.gather(
+        asyncio.to_thread(_run_rag_search, tool_input),
+        _run_web_search(tool_input),
+        asyncio.to_thread(_run_snowflake_search, tool_input),
+        return_exceptions=True
+    )
+    rag_action, web_action, snowflake_action = [
+        _error_action(tool, tool_input, result) if isinstance(result, Exception) else result
+        for tool, result in zip(("rag_search_result", "web_search_result", "snowflake_search_result"), results)
+    ]
+    
+    logger.debug("All data sources queried")
+    
+    return {
+        "intermediate_steps": state["intermediate_steps"] + [rag_action, web_action, snowflake_action],
+        "rag_result": rag_action.log,
+        "web_result": web_action.log,
+        "snowflake_result": snowflake_action.metadata.get("text", snowflake_action.log),
+        "web_links": web_action.metadata.get("links", []),
+        "visualizations": snowflake_action.metadata.get("visualizations", [])
+    }
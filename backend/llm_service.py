@@ -1,26 +1,33 @@
 import os
-import tiktoken
 from google.generativeai import configure, GenerativeModel
 from dotenv import load_dotenv
+from functools import lru_cache
 
 load_dotenv()
 
-def generate_response_with_gemini(query, context=None, model_name="gemini-1.5-pro", response_type="default"):
+# Configure the Gemini SDK once per process. GEMINI_API_KEY is what the Snowflake
+# agent used to read, so deployments that only set that keep working.
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+if not GOOGLE_API_KEY:
+    raise RuntimeError("Gemini API key not configured. Please set the GOOGLE_API_KEY (or GEMINI_API_KEY) environment variable.")
+configure(api_key=GOOGLE_API_KEY)
+
+@lru_cache(maxsize=8)
+def get_gemini_model(model_name="gemini-1.5-pro"):
+    """Build each GenerativeModel once and reuse it (and its transport) across calls.
+
+    This module owns the SDK configuration; other modules should get their
+    models from here rather than calling configure() themselves.
+    """
+    return GenerativeModel(model_name)
+
+async def generate_response_with_gemini(query, context=None, model_name="gemini-1.5-pro", response_type="default"):
     """
-    Generate a response using Google Gemini model
+    Generate a response using Google Gemini model, without blocking the event loop
     response_type: 'default' or 'web_analysis' to handle different prompt structures
     """
     try:
-        # Configure API key
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            return "Error: Google API key not configured. Please set the GOOGLE_API_KEY environment variable.", None
-        
-        configure(api_key=api_key)
-        model = GenerativeModel(model_name)
-        
-        # For token counting
-        encoder = tiktoken.get_encoding("cl100k_base")
+        model = get_gemini_model(model_name)
         
         if response_type == "web_analysis":
             prompt = f"""
@@ -69,15 +76,18 @@ def generate_response_with_gemini(query, context=None, model_name="gemini-1.5-pr
         else:
             prompt = query
         
-        # Count input tokens before API call
-        input_tokens = len(encoder.encode(prompt))
-        
         # Generate response
-        response = model.generate_content(prompt)
+        response = await model.generate_content_async(prompt)
         answer_text = response.text
         
-        # Count output tokens
-        output_tokens = len(encoder.encode(answer_text))
+        # Gemini reports its own token counts with the response
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            input_tokens = usage.prompt_token_count
+            output_tokens = usage.candidates_token_count
+        else:
+            input_tokens = (await model.count_tokens_async(prompt)).total_tokens
+            output_tokens = (await model.count_tokens_async(answer_text)).total_tokens
         
         # Calculate costs based on pricing for Gemini models
         input_cost = (input_tokens / 1000) * 0.0000125
@@ -1,12 +1,13 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import time
 from typing import Dict, List
-from pinecone_db import AgenticResearchAssistant
-from research_graph import initialize_research_graph, run_research_graph
+from pinecone_db import AgenticResearchAssistant, get_research_assistant
+from research_graph import initialize_research_graph, run_research_graph, stream_research_graph
 
 # Define lifespan context manager
 @asynccontextmanager
@@ -15,6 +16,8 @@ async def lifespan(app: FastAPI):
     try:
         initialize_research_graph()
         print("Research graph initialized during server startup")
+        # Share one assistant across requests; its model and index load on first use
+        app.state.assistant = get_research_assistant()
     except Exception as e:
         print(f"Error initializing research graph: {e}")
         raise e
@@ -46,6 +49,10 @@ class QuestionRequest(BaseModel):
 class AvailableQuartersResponse(BaseModel):
     quarters: List[str]
 
+# The quarter list is fixed, so build the response once at import time
+_AVAILABLE_QUARTERS = sorted(f"{year}-Q{quarter}" for year in range(2021, 2026) for quarter in range(1, 5))
+_AVAILABLE_QUARTERS_RESPONSE = AvailableQuartersResponse(quarters=_AVAILABLE_QUARTERS)
+
 # Add new endpoint model
 class WebSearchRequest(BaseModel):
     query: str
@@ -62,6 +69,10 @@ class ResearchRequest(BaseModel):
     year_quarter_dict: Dict[str, List[str]]
     mode: str = "combined"  # "pinecone", "web_search", or "combined"
 
+def get_assistant(request: Request) -> AgenticResearchAssistant:
+    """Dependency returning the assistant created at startup."""
+    return request.app.state.assistant
+
 # API Endpoints
 @app.get("/")
 async def root():
@@ -70,27 +81,23 @@ async def root():
 @app.get("/available_quarters", response_model=AvailableQuartersResponse)
 async def get_available_quarters():
     """Get all available quarters from the vector databases"""
-    quarters = {"2021-Q1", "2021-Q2", "2021-Q3", "2021-Q4",
-                    "2022-Q1", "2022-Q2", "2022-Q3", "2022-Q4",
-                    "2023-Q1", "2023-Q2", "2023-Q3", "2023-Q4",
-                    "2024-Q1", "2024-Q2", "2024-Q3", "2024-Q4",
-                    "2025-Q1", "2025-Q2", "2025-Q3", "2025-Q4"}
-    
-    return {"quarters": sorted(list(quarters))}
+    return _AVAILABLE_QUARTERS_RESPONSE
 
 @app.post("/summarize_using_pinecone")
-def search(request: SearchRequest):
-    assistant = AgenticResearchAssistant()
-    response = assistant.search_pinecone_db(request.query, request.year_quarter_dict)
+def search(request: SearchRequest, assistant: AgenticResearchAssistant = Depends(get_assistant)):
+    try:
+        response = assistant.search_pinecone_db(request.query, request.year_quarter_dict)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching Pinecone: {str(e)}")
     return {"response": response}    
 
-@app.post("/web_search")
+@app.post("/web_search", response_class=ORJSONResponse)
 async def web_search_endpoint(request: WebSearchRequest):
     """Search the web for information about NVIDIA"""
     try:
         from agents.web_search_agent import WebSearchAgent
         agent = WebSearchAgent()
-        results = agent.search_news(request.query, request.num_results)
+        results = await agent.search_news(request.query, request.num_results)
         return {"status": "success", "results": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching web: {str(e)}")
@@ -118,7 +125,7 @@ async def research_endpoint(request: ResearchRequest):
         
         try:
             # Run the research workflow
-            result = run_research_graph(
+            result = await run_research_graph(
                 query=request.query,
                 year_quarter_dict=request.year_quarter_dict,
                 mode=request.mode
@@ -144,14 +151,53 @@ async def research_endpoint(request: ResearchRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error running research workflow: {str(e)}")    
 
+@app.post("/research/stream")
+async def research_stream_endpoint(request: ResearchRequest):
+    """
+    Run the LangGraph research workflow, streaming the final answer as plain text chunks.
+    """
+    print(f"Streaming research request received with mode: {request.mode}")
+    
+    # Same validation as /research, surfaced as HTTP errors since the body is a stream
+    valid_modes = ["pinecone", "web_search", "snowflake", "combined"]
+    if request.mode not in valid_modes:
+        raise HTTPException(status_code=400, detail=f"Invalid mode '{request.mode}'. Must be one of: {', '.join(valid_modes)}")
+    if request.mode in ["pinecone", "snowflake", "combined"] and (not request.year_quarter_dict or not any(request.year_quarter_dict.values())):
+        raise HTTPException(status_code=400, detail=f"For {request.mode} search, at least one year and quarter must be selected")
+    
+    return StreamingResponse(
+        stream_research_graph(
+            query=request.query,
+            year_quarter_dict=request.year_quarter_dict,
+            mode=request.mode
+        ),
+        media_type="text/plain; charset=utf-8"
+    )
+
+def format_pinecone_coverage(total_vectors, year_quarter_map):
+    """Build the /pinecone_data_check response from a {year: {quarter: [samples]}} map."""
+    formatted_results = {
+        "status": "success",
+        "total_vectors": total_vectors,
+        "years_available": sorted(list(year_quarter_map.keys())),
+        "data": {}
+    }
+    
+    # Build a structured response with year/quarter hierarchy
+    for year in sorted(year_quarter_map.keys()):
+        formatted_results["data"][year] = {}
+        
+        for quarter in sorted(year_quarter_map[year].keys()):
+            formatted_results["data"][year][quarter] = year_quarter_map[year][quarter]
+    
+    return formatted_results
+
 @app.get("/pinecone_data_check")
-async def check_pinecone_data():
+async def check_pinecone_data(assistant: AgenticResearchAssistant = Depends(get_assistant)):
     """
     Check which years and quarters have data in Pinecone and return sample records
     """
     try:
-        assistant = AgenticResearchAssistant()
-        
         # Get index statistics
         stats = assistant.index.describe_index_stats()
         total_vectors = stats.get("total_vector_count", 0)
@@ -162,10 +208,17 @@ async def check_pinecone_data():
                 "message": "No data found in Pinecone index."
             }
         
-        # First, let's find what years and quarters are available
+        # Coverage is recorded in the catalog during ingestion. It is only trusted
+        # while it accounts for exactly the vectors the index reports.
+        year_quarter_map, catalog_vectors = assistant.read_catalog()
+        if year_quarter_map and catalog_vectors == total_vectors:
+            return format_pinecone_coverage(total_vectors, year_quarter_map)
+        if year_quarter_map:
+            print(f"Pinecone catalog lists {catalog_vectors} vectors but the index has {total_vectors}; sampling the index instead")
+        
+        # Fall back to sampling the index when the catalog is missing or stale
         # We'll use a minimal vector to get diverse results (not focused on semantic similarity)
-        import numpy as np
-        dummy_vector = np.zeros(assistant.dimension).tolist()
+        dummy_vector = [0.0] * assistant.dimension
         
         results = assistant.index.query(
             vector=dummy_vector,
@@ -198,22 +251,7 @@ async def check_pinecone_data():
                     "text_preview": metadata.get("text", "")[:200] + "..." if metadata.get("text") else "No text"
                 })
         
-        # Format the results for readability
-        formatted_results = {
-            "status": "success",
-            "total_vectors": total_vectors,
-            "years_available": sorted(list(year_quarter_map.keys())),
-            "data": {}
-        }
-        
-        # Build a structured response with year/quarter hierarchy
-        for year in sorted(year_quarter_map.keys()):
-            formatted_results["data"][year] = {}
-            
-            for quarter in sorted(year_quarter_map[year].keys()):
-                formatted_results["data"][year][quarter] = year_quarter_map[year][quarter]
-        
-        return formatted_results
+        return format_pinecone_coverage(total_vectors, year_quarter_map)
         
     except Exception as e:
         return {
@@ -1,5 +1,10 @@
 import re
 import json
+from itertools import chain, tee, zip_longest
+
+# Markdown headers at the beginning of a line, and runs of non-whitespace for word counts.
+_HEADER_RE = re.compile(r'^(#{1,6})\s*(.+)$', re.MULTILINE)
+_WORD_RE = re.compile(r'\S+')
 
 def chunk_markdown_by_headers(markdown_text, ideal_word_count=500):
     """
@@ -23,15 +28,13 @@ def chunk_markdown_by_headers(markdown_text, ideal_word_count=500):
     # Define the threshold to split: 1.5 * ideal_word_count
     split_threshold = int(1.5 * ideal_word_count)
     
-    # Regex to match markdown headers at the beginning of a line.
-    header_pattern = re.compile(r'^(#{1,6})\s*(.+)$', re.MULTILINE)
-    
-    # Find all header matches with their start positions.
-    matches = list(header_pattern.finditer(markdown_text))
+    # Find header matches lazily; each chunk runs from one header to the next.
+    matches = _HEADER_RE.finditer(markdown_text)
     chunks = []
     
     # If no header is found, treat the entire text as one chunk.
-    if not matches:
+    first = next(matches, None)
+    if first is None:
         chunks.append({
             'header': None,
             'level': None,
@@ -39,17 +42,20 @@ def chunk_markdown_by_headers(markdown_text, ideal_word_count=500):
         })
         return chunks
     
-    # Iterate through headers and split text between them.
-    for idx, match in enumerate(matches):
+    # Iterate through (header, next header) pairs and split text between them.
+    current, following = tee(chain([first], matches))
+    next(following, None)
+    for match, next_match in zip_longest(current, following):
         header_line = match.group(0).strip()  # full header line
         header_level = len(match.group(1))      # number of '#' determines level
         start_index = match.start()
-        end_index = matches[idx + 1].start() if idx + 1 < len(matches) else len(markdown_text)
+        end_index = next_match.start() if next_match is not None else len(markdown_text)
         chunk_text = markdown_text[start_index:end_index].strip()
         
-        # Split the chunk into words to check length.
-        words = chunk_text.split()
-        if len(words) > split_threshold:
+        # Count words without materializing them; split only when the chunk is too long.
+        n_words = sum(1 for _ in _WORD_RE.finditer(chunk_text))
+        if n_words > split_threshold:
+            words = chunk_text.split()
             # Split into two parts (roughly equal halves).
             mid_point = len(words) // 2
             part1_text = " ".join(words[:mid_point])
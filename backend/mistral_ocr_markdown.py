@@ -25,13 +25,8 @@ def extract_text_from_pdf(pdf_url):
             },
         )
 
-        # Combine all pages into one markdown document
-        all_pages_markdown = []
-
-        for page in ocr_response.pages:
-            all_pages_markdown.append(page.markdown)
-
-        markdown_content = "\n\n".join(all_pages_markdown)
+        # Combine all pages into one markdown document in a single pass
+        markdown_content = "\n\n".join(page.markdown for page in ocr_response.pages)
 
         print(f"Successfully extracted {len(markdown_content)} characters with Mistral OCR")
         
@@ -8,7 +8,11 @@ import time
 import requests
 from s3_utils import upload_file_to_s3
 
-def fetch_nvidia_financial_reports():
+def fetch_nvidia_financial_reports(on_upload=None):
+    """
+    Download the 10-K/10-Q PDFs and upload them to S3. If on_upload is given it is
+    called with each PDF's S3 key as soon as that PDF is uploaded.
+    """
     url = "https://investor.nvidia.com/financial-info/quarterly-results/default.aspx"
     
     # Set up Selenium WebDriver options
@@ -77,6 +81,8 @@ def fetch_nvidia_financial_reports():
                                         "s3_path": file_path
                                     })
                                     print(f"Uploaded PDF to S3: {path}")
+                                    if on_upload is not None:
+                                        on_upload(path)
 
                 except Exception as e:
                     #print(f"Uploaded PDF to S3: {status}")
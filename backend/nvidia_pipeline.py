@@ -1,49 +1,85 @@
 from backend.nvidia_pdf_extraction import fetch_nvidia_financial_reports
-from backend.s3_utils import fetch_s3_urls, get_presigned_url, upload_to_s3
+from backend.s3_utils import get_presigned_url, upload_to_s3
 from backend.mistral_ocr_markdown import extract_text_from_pdf
 from backend.pinecone_db import extract_filename_year_quarter, AgenticResearchAssistant
-import time
+import asyncio
 
-def fetch_pdf_s3_upload():
+def fetch_pdf_s3_upload(on_upload=None):
     # Step 1: Fetch NVIDIA financial reports
     print("Step 1: Fetching financial reports...")
-    reports = fetch_nvidia_financial_reports()
+    reports = fetch_nvidia_financial_reports(on_upload=on_upload)
     print("Reports fetched successfully:")
     for report in reports:
         print(f"Fetched: {report['pdf_filename']} (Size: {report['content']} bytes)")
     return reports
 
-def convert_markdown_s3_upload():
-    # Instantiate the OCR extractor only once
-    s3_urls = fetch_s3_urls("pdf/")
-    s3_urls = s3_urls[1:]
-    for input_url in s3_urls:
-        output_url = "markdown"+input_url[3:-3]+"md"
-        pdf_url = get_presigned_url(input_url)
-        markdown_content = extract_text_from_pdf(pdf_url)
-        upload_to_s3(output_url, markdown_content)
-        print(f"{input_url} converted to md")
-        time.sleep(10)
-
-def generate_pinecone_embeddings(assistant):
-    """Fetch all markdown URLs under the 'markdown' folder and convert them to presigned URLs."""
-    print("Fetching markdown files...")
-    markdown_urls = fetch_s3_urls("markdown/")
-    markdown_urls = markdown_urls[1:]
-    presigned_urls = [get_presigned_url(url) for url in markdown_urls]
-    print(f"Fetched {len(presigned_urls)} markdown files.")
-
-    # Step 2: Process each markdown file and insert embeddings into Pinecone
-    for url in presigned_urls:
-        print(url)
-        filename, year, quarter = extract_filename_year_quarter(url)  # Extract metadata from filename
-        assistant.insert_embeddings(url, year, quarter, filename)
-        print(f"Inserted Embeddings for the {year} and {quarter}")
+# Concurrent OCR jobs; bounded by Mistral's rate limit rather than a fixed sleep
+OCR_CONCURRENCY = 4
+
+def _markdown_path(input_url):
+    return "markdown" + input_url[3:-3] + "md"
+
+async def _ocr_and_upload(input_url, output_url):
+    pdf_url = await asyncio.to_thread(get_presigned_url, input_url)
+    markdown_content = await asyncio.to_thread(extract_text_from_pdf, pdf_url)
+    await asyncio.to_thread(upload_to_s3, output_url, markdown_content)
+    print(f"{input_url} converted to md")
+    return markdown_content
+
+async def run_ingestion_pipeline(assistant, ocr_workers=OCR_CONCURRENCY):
+    """
+    Stream each report through download -> OCR -> markdown upload -> embedding. The
+    scraper hands over each PDF as soon as it is in S3, so OCR starts while later
+    quarters are still downloading and a file is embedded as soon as its OCR finishes.
+    """
+    loop = asyncio.get_running_loop()
+    ocr_q = asyncio.Queue(maxsize=ocr_workers * 2)
+    embed_q = asyncio.Queue(maxsize=ocr_workers * 2)
+
+    async def ocr_worker():
+        while True:
+            input_url = await ocr_q.get()
+            if input_url is None:
+                break
+            output_url = _markdown_path(input_url)
+            try:
+                markdown_content = await _ocr_and_upload(input_url, output_url)
+            except Exception as e:
+                print(f"Failed to convert {input_url}: {e}")
+                continue
+            await embed_q.put((output_url, markdown_content))
+
+    async def embed_worker():
+        # A single consumer keeps encoder work serialized while OCR continues
+        while True:
+            item = await embed_q.get()
+            if item is None:
+                break
+            output_url, markdown_text = item
+            filename, year, quarter = extract_filename_year_quarter(output_url)
+            await asyncio.to_thread(assistant.insert_markdown_embeddings, markdown_text, year, quarter, filename)
+            print(f"Inserted Embeddings for the {year} and {quarter}")
+
+    ocr_tasks = [asyncio.create_task(ocr_worker()) for _ in range(ocr_workers)]
+    embed_task = asyncio.create_task(embed_worker())
+
+    # Producer: the Selenium scraper runs in a worker thread and enqueues each PDF
+    # key once it is uploaded; a full queue blocks it, so downloads stay just ahead of OCR
+    def enqueue(s3_key):
+        asyncio.run_coroutine_threadsafe(ocr_q.put(s3_key), loop).result()
+
+    try:
+        await asyncio.to_thread(fetch_pdf_s3_upload, enqueue)
+    finally:
+        # Finish the PDFs already handed over, even if scraping stopped early
+        for _ in ocr_tasks:
+            await ocr_q.put(None)
+        await asyncio.gather(*ocr_tasks)
+        await embed_q.put(None)
+        await embed_task
 
 
 if __name__ == '__main__':
     # Run the pipeline only once
-    reports = fetch_pdf_s3_upload()
-    convert_markdown_s3_upload()
     assistant = AgenticResearchAssistant()
-    generate_pinecone_embeddings(assistant)
\ No newline at end of file
+    asyncio.run(run_ingestion_pipeline(assistant))
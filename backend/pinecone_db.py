@@ -1,15 +1,38 @@
 import os
+import json
+import heapq
+import sqlite3
+import pathlib
 import logging
+import threading
 from dotenv import load_dotenv
+import torch
 from sentence_transformers import SentenceTransformer
 from pinecone import Pinecone, ServerlessSpec
-import google.generativeai as genai
 from markdown_chunking import chunk_markdown_by_headers
+from llm_service import GOOGLE_API_KEY, get_gemini_model
 import requests
 from urllib.parse import urlparse
+from functools import cached_property, lru_cache
+from cachetools import LRUCache
 
 load_dotenv()
 
+# Catalog of which (year, quarter, filename) combinations have been embedded. It is
+# written by the ingestion pipeline and read by the API, so the default lives next
+# to this module rather than in whichever directory the process was started from;
+# docker-compose mounts the same directory into the backend container.
+CATALOG_PATH = os.getenv(
+    "PINECONE_CATALOG_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog", "pinecone_catalog.db")
+)
+
+# Vectors per upsert request; keeps each request well under Pinecone's 2 MB limit
+UPSERT_BATCH_SIZE = 100
+
+# Quarter word in report filenames -> quarter number
+_QUARTER_WORDS = {"first": "1", "second": "2", "third": "3", "fourth": "4"}
+
 def extract_filename_year_quarter(url: str):
     """
     Extracts the filename, year, and quarter from a given URL.
@@ -27,19 +50,12 @@ def extract_filename_year_quarter(url: str):
     # Get the filename from the path
     filename = os.path.basename(path)
     
-    # Extract year and quarter using the provided function logic
-    def extract_year_and_quarter(file_path: str):
-        base = os.path.basename(file_path)
-        name, _ = os.path.splitext(base)
-        parts = name.split("_")
-        if len(parts) >= 2:
-            year = parts[0]
-            quarter_word = parts[1].lower()
-            mapping = {"first": "1", "second": "2", "third": "3", "fourth": "4"}
-            quarter = mapping.get(quarter_word, "Unknown")
-            return year, quarter
-        return "Unknown", "Unknown"
-    year, quarter = extract_year_and_quarter(filename)
+    # Extract year and quarter from names like "2024_Third_Quarter.md"
+    parts = os.path.splitext(filename)[0].split("_", 2)
+    if len(parts) >= 2:
+        year, quarter = parts[0], _QUARTER_WORDS.get(parts[1].casefold(), "Unknown")
+    else:
+        year, quarter = "Unknown", "Unknown"
     return filename, year, quarter
 
 class AgenticResearchAssistant:
@@ -49,20 +65,33 @@ class AgenticResearchAssistant:
         
         # Load environment variables
         self.PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-        self.GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+        self.GOOGLE_API_KEY = GOOGLE_API_KEY
         
         print(f"PINECONE_API_KEY: {self.PINECONE_API_KEY}")
-        # Initialize Pinecone
-        self.pc = Pinecone(api_key=self.PINECONE_API_KEY)
+        print(f"GOOGLE_API_KEY: {self.GOOGLE_API_KEY}")
         self.index_name = "nvidia-agentic-research-assistant"
         self.dimension = 384  # Matching the embedding model's output size
         
-        # Configure Gemini API
-        genai.configure(api_key=self.GOOGLE_API_KEY)
-        print(f"GOOGLE_API_KEY: {self.GOOGLE_API_KEY}")
-        self.gemini_model = genai.GenerativeModel("gemini-1.5-pro")
-        
-        # Check and create Pinecone index if it doesn’t exist
+        # Bounded cache of normalized query -> embedding
+        self._query_cache = LRUCache(maxsize=1024)
+        self._query_cache_lock = threading.Lock()
+
+    # Heavy resources are created on first use, so endpoints that only need the
+    # index (e.g. /pinecone_data_check) never load the embedding model.
+    @cached_property
+    def pc(self):
+        return Pinecone(api_key=self.PINECONE_API_KEY)
+
+    @cached_property
+    def gemini_model(self):
+        # Gemini is configured once in llm_service; the model is shared by every instance
+        return get_gemini_model("gemini-1.5-pro")
+
+    @cached_property
+    def index(self):
+        # Check and create Pinecone index if it doesn’t exist.
+        # Serverless indexes store dense float32 vectors only (no int8/PQ option),
+        # so embeddings stay full precision; there is no local vector math to quantize.
         if self.index_name not in [index["name"] for index in self.pc.list_indexes()]:
             self.pc.create_index(
                 name=self.index_name,
@@ -75,12 +104,19 @@ class AgenticResearchAssistant:
             logging.info(f"Index '{self.index_name}' already exists.")
         
         # Connect to the index and print its stats
-        self.index = self.pc.Index(self.index_name)
-        logging.info(f"Pinecone index stats: {self.index.describe_index_stats()}")
-        
-        # Load Sentence Transformer Model
-        self.model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-        logging.info("Sentence Transformer model loaded.")
+        index = self.pc.Index(self.index_name, pool_threads=16)
+        logging.info(f"Pinecone index stats: {index.describe_index_stats()}")
+        return index
+
+    @cached_property
+    def model(self):
+        # Run the encoder on GPU in FP16 when one is available
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device=device)
+        if device == "cuda":
+            model.half()
+        logging.info(f"Sentence Transformer model loaded on {device}.")
+        return model
 
     def process_markdown(self, file_path):
         """Reads a markdown file and processes it into chunks."""
@@ -100,8 +136,13 @@ class AgenticResearchAssistant:
             # Fetch markdown content from the presigned URL
             response = requests.get(presigned_url)
             response.raise_for_status()  # Raise an error for failed requests
-            markdown_text = response.text
-            
+            self.insert_markdown_embeddings(response.text, year, quarter, filename)
+        except Exception as e:
+            logging.error(f"Error processing presigned URL: {e}")
+
+    def insert_markdown_embeddings(self, markdown_text, year, quarter, filename):
+        """Chunks already-fetched markdown, generates embeddings, and inserts into Pinecone."""
+        try:
             # Process chunks from markdown content
             chunks = chunk_markdown_by_headers(markdown_text)
             if not chunks:
@@ -111,8 +152,13 @@ class AgenticResearchAssistant:
             # Extract only the text content from chunks
             chunk_texts = [chunk["content"] for chunk in chunks]
 
-            # Generate embeddings
-            embeddings = self.model.encode(chunk_texts).tolist()
+            # Generate embeddings once per distinct text; boilerplate chunks repeat verbatim
+            unique_texts = {}
+            indices = [unique_texts.setdefault(text, len(unique_texts)) for text in chunk_texts]
+            encoded = self.model.encode(
+                list(unique_texts), batch_size=64, convert_to_numpy=True, normalize_embeddings=True
+            ).tolist()
+            embeddings = [encoded[i] for i in indices]
             logging.info(f"Generated embeddings for {len(embeddings)} chunks.")
 
             # Prepare batch upserts for Pinecone
@@ -129,34 +175,112 @@ class AgenticResearchAssistant:
                 }
                 pinecone_data.append((f"{year}_{quarter}_{i}", embedding, metadata))
             
-            # Insert data into Pinecone in batch
-            self.index.upsert(pinecone_data)
+            # Insert data into Pinecone in fixed-size batches, dispatched concurrently
+            futures = [
+                self.index.upsert(vectors=pinecone_data[i:i + UPSERT_BATCH_SIZE], async_req=True)
+                for i in range(0, len(pinecone_data), UPSERT_BATCH_SIZE)
+            ]
+            for future in futures:
+                future.get()
             logging.info(f"Inserted {len(pinecone_data)} chunks into Pinecone successfully.")
+
+            # Record coverage so the data check endpoint does not need to query the index
+            samples = [
+                {
+                    "id": vector_id,
+                    "score": None,  # Not a query match; keeps the shape of the index-sampled records
+                    "header": metadata["header"],
+                    "text_preview": metadata["text"][:200] + "..." if metadata["text"] else "No text"
+                }
+                for vector_id, _, metadata in pinecone_data[:3]
+            ]
+            self.update_catalog(year, quarter, filename, len(pinecone_data), samples)
         except Exception as e:
-            logging.error(f"Error processing presigned URL: {e}")
+            logging.error(f"Error inserting embeddings for {filename}: {e}")
         
+    def _catalog_connection(self):
+        os.makedirs(os.path.dirname(CATALOG_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(CATALOG_PATH)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS year_quarter_catalog (
+                year TEXT, quarter TEXT, filename TEXT, count INTEGER, samples TEXT,
+                PRIMARY KEY (year, quarter, filename)
+            )"""
+        )
+        return conn
+
+    def update_catalog(self, year, quarter, filename, count, samples):
+        """Upsert the catalog row for one embedded file."""
+        try:
+            with self._catalog_connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO year_quarter_catalog VALUES (?, ?, ?, ?, ?)",
+                    (str(year), str(quarter), filename, count, json.dumps(samples))
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error updating Pinecone catalog: {e}")
+
+    def read_catalog(self):
+        """
+        Return ({year: {quarter: [samples]}}, vector count) from the catalog, or
+        ({}, 0) if it is empty or unavailable. The catalog is opened read-only, so
+        reading never creates an empty database in place of the shared one.
+        """
+        year_quarter_map = {}
+        try:
+            conn = sqlite3.connect(f"{pathlib.Path(CATALOG_PATH).resolve().as_uri()}?mode=ro", uri=True)
+            try:
+                rows = conn.execute(
+                    "SELECT year, quarter, count, samples FROM year_quarter_catalog ORDER BY year, quarter, filename"
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Pinecone catalog unavailable at {CATALOG_PATH}: {e}")
+            return year_quarter_map, 0
+        total_count = 0
+        for year, quarter, count, samples in rows:
+            total_count += count
+            quarter_samples = year_quarter_map.setdefault(year, {}).setdefault(quarter, [])
+            quarter_samples.extend(json.loads(samples)[:3 - len(quarter_samples)])
+        return year_quarter_map, total_count
+
+    def _embed_query(self, query):
+        """Encode a query, reusing the embedding for repeated (whitespace/case-normalized) queries."""
+        key = " ".join(query.split()).lower()
+        with self._query_cache_lock:
+            embedding = self._query_cache.get(key)
+        if embedding is None:
+            embedding = self.model.encode([query], normalize_embeddings=True).tolist()
+            with self._query_cache_lock:
+                self._query_cache[key] = embedding
+        return embedding
+
     def search_pinecone_db(self, query, year_quarter_dict, top_k=20):
         """Search for relevant chunks in Pinecone, filtering by multiple years and quarters, and generate a response using Gemini."""
-        query_embedding = self.model.encode([query]).tolist()
+        query_embedding = self._embed_query(query)
         try:
-            # Construct metadata filter for multiple years and quarters
-            filter_criteria = {
-                "$or": [
-                    {"year": {"$eq": str(year)}, "quarter": {"$in": [str(q) for q in quarters]}}
-                    for year, quarters in year_quarter_dict.items()
-                ]
-            }
-            print(filter_criteria)
-
-            # Perform a filtered search in Pinecone
-            results = self.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True,
-                filter=filter_criteria  # Apply filtering
-            )
+            # One narrow filter per year; the sub-queries run concurrently on the index pool
+            subfilters = [
+                {"year": {"$eq": str(year)}, "quarter": {"$in": [str(q) for q in quarters]}}
+                for year, quarters in year_quarter_dict.items()
+            ]
+            print(subfilters)
+
+            futures = [
+                self.index.query(
+                    vector=query_embedding,
+                    top_k=top_k,
+                    include_metadata=True,
+                    filter=subfilter,
+                    async_req=True
+                )
+                for subfilter in subfilters
+            ]
+            all_matches = [match for future in futures for match in future.get().get("matches", [])]
 
-            matches = results.get("matches", [])
+            # Keep the overall top_k across partitions
+            matches = heapq.nlargest(top_k, all_matches, key=lambda match: match["score"])
             if not matches:
                 logging.warning(f"No relevant matches found for the given year-quarter combinations.")
                 return "No relevant information found for the specified year and quarters."
@@ -180,5 +304,10 @@ class AgenticResearchAssistant:
             return response.text
         except Exception as e:
             logging.error(f"Error during search: {e}")
-            return "Error occurred during search."
+            raise
         
+
+@lru_cache(maxsize=None)
+def get_research_assistant():
+    """Return the process-wide AgenticResearchAssistant, creating it on first use."""
+    return AgenticResearchAssistant()
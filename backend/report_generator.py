@@ -1,33 +1,43 @@
-def build_report(output: dict) -> str:
-    """
-    Format the final output into a structured report.
-    """
-    research_steps = output["research_steps"]
-    if type(research_steps) is list:
-        research_steps = "\n".join([f"- {r}" for r in research_steps])
-    
-    sources = output["sources"]
-    if type(sources) is list:
-        sources = "\n".join([f"- {s}" for s in sources])
-    
-    return f"""
+from string import Template
+
+_REPORT_TEMPLATE = Template("""
 INTRODUCTION
 ------------
-{output["introduction"]}
+$introduction
 
 RESEARCH STEPS
 --------------
-{research_steps}
+$research_steps
 
 REPORT
 ------
-{output["main_body"]}
+$main_body
 
 CONCLUSION
 ----------
-{output["conclusion"]}
+$conclusion
 
 SOURCES
 -------
-{sources}
-"""
+$sources
+""")
+
+def build_report(output: dict) -> str:
+    """
+    Format the final output into a structured report.
+    """
+    research_steps = output["research_steps"]
+    if isinstance(research_steps, list):
+        research_steps = "\n".join(f"- {r}" for r in research_steps)
+
+    sources = output["sources"]
+    if isinstance(sources, list):
+        sources = "\n".join(f"- {s}" for s in sources)
+
+    return _REPORT_TEMPLATE.substitute(
+        introduction=output["introduction"],
+        research_steps=research_steps,
+        main_body=output["main_body"],
+        conclusion=output["conclusion"],
+        sources=sources
+    )
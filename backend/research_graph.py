@@ -1,100 +1,175 @@
+import json
+import logging
+import threading
+from cachetools import TTLCache
 from langgraph.graph import StateGraph, END
 from state import ResearchState
-from graph_functions import run_oracle, router, rag_search, web_search, generate_final_answer, snowflake_search
+from graph_functions import run_oracle, router, rag_search, web_search, generate_final_answer, snowflake_search, combined_fanout
 
-# Global variable to store the compiled graph
-_GLOBAL_GRAPH = None
+logger = logging.getLogger(__name__)
 
-def initialize_research_graph():
-    """
-    Initialize the research graph once and store it in memory.
-    Returns the compiled graph instance.
-    """
-    global _GLOBAL_GRAPH
+def _build_graph():
+    """Build and compile the research graph."""
+    logger.info("Initializing new research graph...")
+    # Create a new graph
+    graph = StateGraph(ResearchState)
     
-    if _GLOBAL_GRAPH is None:
-        print("Initializing new research graph...")
-        # Create a new graph
-        graph = StateGraph(ResearchState)
-        
-        # Add nodes with lambda wrappers
-        graph.add_node("oracle", lambda x: run_oracle(x))
-        graph.add_node("rag_search", lambda x: rag_search(x))
-        graph.add_node("web_search", lambda x: web_search(x))
-        graph.add_node("snowflake_search", lambda x: snowflake_search(x))
-        graph.add_node("final_answer", lambda x: generate_final_answer(x))
-        
-        # Set the entry point
-        graph.set_entry_point("oracle")
-        
-        # Add conditional edges
-        graph.add_conditional_edges(
-            "oracle",
-            router,
-            {
-                "rag_search": "rag_search",
-                "web_search": "web_search",
-                "snowflake_search": "snowflake_search",
-                "final_answer": "final_answer"
-            }
-        )
-        
-        # Add edges from search nodes back to oracle
-        graph.add_edge("rag_search", "oracle")
-        graph.add_edge("web_search", "oracle")
-        graph.add_edge("snowflake_search", "oracle")
-        graph.add_edge("final_answer", END)
-        
-        # Compile and store the graph
-        _GLOBAL_GRAPH = graph.compile()
-        print("Research graph initialized and compiled successfully")
+    # Add nodes. web_search and combined_fanout are coroutines, registered
+    # directly so LangGraph awaits them; the synchronous nodes run in an executor.
+    graph.add_node("oracle", run_oracle)
+    graph.add_node("rag_search", rag_search)
+    graph.add_node("web_search", web_search)
+    graph.add_node("snowflake_search", snowflake_search)
+    graph.add_node("combined_fanout", combined_fanout)
+    graph.add_node("final_answer", generate_final_answer)
     
-    return _GLOBAL_GRAPH
+    # Set the entry point
+    graph.set_entry_point("oracle")
+    
+    # Add conditional edges
+    graph.add_conditional_edges(
+        "oracle",
+        router,
+        {
+            "rag_search": "rag_search",
+            "web_search": "web_search",
+            "snowflake_search": "snowflake_search",
+            "combined_fanout": "combined_fanout",
+            "final_answer": "final_answer"
+        }
+    )
+    
+    # The oracle plans the whole route up front, so every search node
+    # (and the combined fanout) goes straight to the final answer
+    graph.add_edge("rag_search", "final_answer")
+    graph.add_edge("web_search", "final_answer")
+    graph.add_edge("snowflake_search", "final_answer")
+    graph.add_edge("combined_fanout", "final_answer")
+    graph.add_edge("final_answer", END)
+    
+    compiled = graph.compile()
+    logger.info("Research graph initialized and compiled successfully")
+    return compiled
 
-def run_research_graph(query, year_quarter_dict=None, mode="combined"):
+# The graph shape is fixed, so compile it at import time rather than on the first request
+_GLOBAL_GRAPH = _build_graph()
+
+def initialize_research_graph():
     """
-    Run the research workflow using the existing graph instance.
+    Return the compiled graph instance (kept for existing callers).
     """
-    print("\n" + "#"*100)
-    print(f"📊 STARTING RESEARCH GRAPH EXECUTION 📊")
-    print("#"*100)
-    print(f"Query: \"{query}\"")
-    print(f"Mode: {mode}")
-    print(f"Year/quarter filters: {year_quarter_dict}")
-    print("#"*100 + "\n")
-    
-    # Initialize the state for this query
-    state = {
+    return _GLOBAL_GRAPH
+
+# Final answers for recently seen (query, filters, mode) triples, so retries and
+# page refreshes do not re-run every search
+_RESULT_CACHE = TTLCache(maxsize=256, ttl=600)
+_RESULT_CACHE_LOCK = threading.Lock()
+
+def _result_key(query, year_quarter_dict, mode):
+    return (query, json.dumps(year_quarter_dict or {}, sort_keys=True), mode)
+
+def _is_cacheable(state):
+    """True unless one of the search nodes that ran flagged an error on its action."""
+    return not any(step.metadata.get("error") for step in state.get("intermediate_steps") or [])
+
+# Marks an error raised after streaming started; whatever follows it is the message
+STREAM_ERROR_MARKER = "\n\n[[STREAM_ERROR]] "
+
+def _initial_state(query, year_quarter_dict, mode):
+    """Build the graph input state for a query."""
+    return {
         "input": query,
         "chat_history": [],
         "intermediate_steps": [],
         "metadata_filters": year_quarter_dict or {},
         "mode": mode
     }
+
+async def stream_research_graph(query, year_quarter_dict=None, mode="combined"):
+    """
+    Run the research workflow, yielding the final answer text as it is generated.
+    The LLM tokens are yielded first, followed by the appended sources and visualizations.
+    """
+    key = _result_key(query, year_quarter_dict, mode)
+    with _RESULT_CACHE_LOCK:
+        cached = _RESULT_CACHE.get(key)
+    if cached is not None:
+        yield cached
+        return
+    
+    graph = initialize_research_graph()
+    streamed = []
+    
+    try:
+        async for stream_mode, payload in graph.astream(
+            _initial_state(query, year_quarter_dict, mode),
+            stream_mode=["messages", "updates"]
+        ):
+            if stream_mode == "messages":
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") == "final_answer" and chunk.content:
+                    streamed.append(chunk.content)
+                    yield chunk.content
+            elif "final_answer" in payload:
+                update = payload["final_answer"]
+                output = update.get("output", "")
+                streamed_text = "".join(streamed)
+                if output.startswith(streamed_text):
+                    yield output[len(streamed_text):]
+                else:
+                    # The streamed tokens did not add up to the final text; send only
+                    # the sources/visualizations appendix rather than the answer again
+                    yield update["intermediate_steps"][-1].metadata.get("appendix", "")
+                # The final answer's steps include every search action that ran
+                if output and _is_cacheable(update):
+                    with _RESULT_CACHE_LOCK:
+                        _RESULT_CACHE[key] = output
+    except Exception as e:
+        # The 200 status is already sent, so tell the client in the body that the
+        # answer is incomplete instead of just closing the stream
+        logger.exception("Research stream failed")
+        yield f"{STREAM_ERROR_MARKER}{e}"
+
+async def run_research_graph(query, year_quarter_dict=None, mode="combined"):
+    """
+    Run the research workflow using the existing graph instance.
+    Must be awaited on the server's event loop, which the async Gemini client is bound to.
+    """
+    logger.debug("Starting research graph: query=%r, mode=%s, filters=%s", query, mode, year_quarter_dict)
+    
+    key = _result_key(query, year_quarter_dict, mode)
+    with _RESULT_CACHE_LOCK:
+        cached = _RESULT_CACHE.get(key)
+    if cached is not None:
+        logger.debug("Returning cached research result")
+        return cached
+    
+    # Initialize the state for this query
+    state = _initial_state(query, year_quarter_dict, mode)
     
     # Get the existing graph instance
     graph = initialize_research_graph()
-    print(f"Using existing graph with nodes: {list(graph.nodes.keys())}")
-    result = graph.invoke(state)
+    result = await graph.ainvoke(state)
     
-    print("\n" + "#"*100)
-    print("📋 GRAPH EXECUTION COMPLETED")
-    print("#"*100 + "\n")
+    logger.debug("Research graph execution completed")
     
     # Extract result
     if "output" in result:
-        print("Using output field from result")
+        logger.debug("Using output field from result")
+        # A degraded answer built around a failed search is not worth replaying
+        if _is_cacheable(result):
+            with _RESULT_CACHE_LOCK:
+                _RESULT_CACHE[key] = result["output"]
         return result["output"]
     
-    # Fallback to intermediate steps
-    try:
-        if "intermediate_steps" in result and result["intermediate_steps"]:
-            for step in result["intermediate_steps"]:
-                if hasattr(step, 'tool') and step.tool == "final_answer_result":
-                    print("Using final_answer_result from intermediate_steps")
-                    return step.log
-    except Exception as e:
-        print(f"Error extracting from intermediate_steps: {e}")
+    # Fallback to the first final_answer_result in the intermediate steps
+    final_log = next(
+        (step.log for step in result.get("intermediate_steps") or [] if getattr(step, "tool", None) == "final_answer_result"),
+        None
+    )
+    if final_log is not None:
+        logger.debug("Using final_answer_result from intermediate_steps")
+        return final_log
     
-    print("No result found, returning fallback message")
+    logger.warning("No result found, returning fallback message")
     return "No comprehensive results available. Please try again with a different query."
\ No newline at end of file
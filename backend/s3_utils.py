@@ -1,18 +1,82 @@
 import boto3
+import hashlib
+import io
 import os
+import threading
+import time
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from cachetools import LRUCache
 import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Large bodies are split into 8 MB parts uploaded concurrently; small ones go in one PUT
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True
+)
+
+# Presigned URLs by (bucket, key, expiry, content type) -> (url, reuse_until)
+_PRESIGN_CACHE = LRUCache(maxsize=2048)
+_PRESIGN_LOCK = threading.Lock()
+
+def _presign_get(s3_key, expiry, content_type=None):
+    """
+    Return a presigned GET URL, reusing an earlier signature for the same object.
+    A cached URL is handed out only while it still has a good part of its lifetime
+    left (an hour for 24-hour URLs, half the expiry for short ones).
+    """
+    cache_key = (AWS_S3_BUCKET_NAME, s3_key, expiry, content_type)
+    now = time.monotonic()
+    with _PRESIGN_LOCK:
+        entry = _PRESIGN_CACHE.get(cache_key)
+    if entry is not None and entry[1] > now:
+        return entry[0]
+    
+    params = {'Bucket': AWS_S3_BUCKET_NAME, 'Key': s3_key}
+    if content_type:
+        params['ResponseContentType'] = content_type
+    url = get_s3_client().generate_presigned_url('get_object', Params=params, ExpiresIn=expiry)
+    
+    with _PRESIGN_LOCK:
+        _PRESIGN_CACHE[cache_key] = (url, now + expiry - min(3600, expiry // 2))
+    return url
+
+# Prefix expired after a day by setup_visualization_lifecycle_rule
+TEMP_VISUALIZATION_PREFIX = 'visualizations/temp/'
+
+# Content types for the visualization formats we upload
+_IMAGE_CONTENT_TYPES = {".png": "image/png", ".webp": "image/webp"}
+
+def _as_fileobj(content):
+    """Wrap bytes/str in a buffer; file-like objects are passed through."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    if isinstance(content, (bytes, bytearray)):
+        return io.BytesIO(content)
+    return content
+
+# AWS settings, resolved once at import
+AWS_S3_BUCKET_NAME = os.getenv('AWS_S3_BUCKET_NAME')
+AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
+AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
+AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
+
+@lru_cache(maxsize=1)
 def get_s3_client():
-    """Get configured S3 client."""
+    """Get configured S3 client (built once; boto3 clients are thread-safe)."""
     return boto3.client(
         's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_REGION', 'us-east-1')
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION
     )
 
 def upload_file_to_s3(file_content, filename, folder="default", is_temp=False):
@@ -29,7 +93,7 @@ def upload_file_to_s3(file_content, filename, folder="default", is_temp=False):
         s3_key: The S3 key where the file was stored
     """
     s3_client = get_s3_client()
-    bucket_name = os.getenv('AWS_S3_BUCKET_NAME')
+    bucket_name = AWS_S3_BUCKET_NAME
     
     # For temporary visualizations, use the temp subfolder
     if is_temp and folder == "visualizations":
@@ -38,19 +102,17 @@ def upload_file_to_s3(file_content, filename, folder="default", is_temp=False):
         s3_key = f"{folder}/{filename}"
     
     # Upload the file
-    s3_client.put_object(
+    s3_client.upload_fileobj(
+        Fileobj=_as_fileobj(file_content),
         Bucket=bucket_name,
         Key=s3_key,
-            Body=file_content
+        Config=TRANSFER_CONFIG
     )
     
     return s3_key
 
 def generate_presigned_url(s3_key, expiry=3600):
     """Generate a presigned URL for an S3 object."""
-    s3_client = get_s3_client()
-    bucket_name = os.getenv('AWS_S3_BUCKET_NAME')
-    
     # Adjust expiry based on folder
     if "/visualizations/temp/" in s3_key:
         # Short expiry for temporary visualizations
@@ -58,16 +120,17 @@ def generate_presigned_url(s3_key, expiry=3600):
     else:
         actual_expiry = expiry
     
-    url = s3_client.generate_presigned_url(
-        'get_object',
-        Params={
-            'Bucket': bucket_name,
-            'Key': s3_key
-        },
-        ExpiresIn=actual_expiry
-    )
-    
-    return url
+    return _presign_get(s3_key, actual_expiry)
+
+def _object_exists(s3_client, s3_key):
+    """HEAD an object; only a missing key counts as absent, other errors propagate."""
+    try:
+        s3_client.head_object(Bucket=AWS_S3_BUCKET_NAME, Key=s3_key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
 
 def upload_visualization_to_s3(image_data, prefix, filename):
     """
@@ -76,31 +139,32 @@ def upload_visualization_to_s3(image_data, prefix, filename):
     Args:
         image_data: Binary image data
         prefix: Folder path (e.g., 'visualizations/temp/query_20240315_123456')
-        filename: Name of the file (e.g., 'time_series.png')
+        filename: Name of the file (e.g., 'time_series.webp'); its extension sets the content type
     """
     try:
-        # Create the full S3 key
-        s3_key = f"{prefix}/{filename}"
+        content_type = _IMAGE_CONTENT_TYPES.get(os.path.splitext(filename)[1].lower(), 'image/png')
         
-        # Upload to S3
-        s3_client = boto3.client('s3')
-        s3_client.put_object(
-            Bucket=os.getenv('AWS_S3_BUCKET_NAME'),
-            Key=s3_key,
-            Body=image_data,
-            ContentType='image/png'
-        )
+        # Key the object by its content so an identical chart is stored once
+        if not isinstance(image_data, (bytes, bytearray)):
+            image_data = image_data.read()
+        key_hash = hashlib.sha256(image_data).hexdigest()[:16]
+        s3_key = f"{prefix}/{key_hash}_{filename}"
+        
+        # Upload to S3 unless the same bytes are already there. Keys under the
+        # temp prefix are per-query and expire via the lifecycle rule, so a HEAD
+        # would almost never hit and could find an object about to be deleted.
+        s3_client = get_s3_client()
+        if s3_key.startswith(TEMP_VISUALIZATION_PREFIX) or not _object_exists(s3_client, s3_key):
+            s3_client.upload_fileobj(
+                Fileobj=io.BytesIO(image_data),
+                Bucket=AWS_S3_BUCKET_NAME,
+                Key=s3_key,
+                ExtraArgs={'ContentType': content_type},
+                Config=TRANSFER_CONFIG
+            )
         
         # Generate presigned URL with 24-hour expiry
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': os.getenv('AWS_S3_BUCKET_NAME'),
-                'Key': s3_key,
-                'ResponseContentType': 'image/png'
-            },
-            ExpiresIn=86400  # 24 hours
-        )
+        presigned_url = _presign_get(s3_key, 86400, content_type=content_type)
         
         return presigned_url
         
@@ -108,36 +172,61 @@ def upload_visualization_to_s3(image_data, prefix, filename):
         print(f"Error uploading to S3: {e}")
         raise
 
+def upload_visualizations_bulk(items, max_workers=8):
+    """
+    Upload several visualizations concurrently, replacing one-by-one upload loops.
+    
+    Args:
+        items: Iterable of (image_data, prefix, filename). A generator is consumed
+               as it yields, so charts upload while later ones are still rendered.
+        max_workers: Maximum number of concurrent uploads
+        
+    Returns:
+        List of presigned URLs, in the same order as items
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(upload_visualization_to_s3, image_data, prefix, filename)
+            for image_data, prefix, filename in items
+        ]
+        return [future.result() for future in futures]
+
 def setup_visualization_lifecycle_rule():
     """Setup lifecycle rule to expire temporary visualizations after 1 day."""
     print("Setting up visualization lifecycle rule")
     s3_client = get_s3_client()
-    bucket_name = os.getenv('AWS_S3_BUCKET_NAME')
-    try:
-        # Create lifecycle configuration
-        lifecycle_config = {
-            'Rules': [
-                {
-                    'ID': 'Expire-temp-visualizations',
-                    'Status': 'Enabled',
-                    'Filter': {
-                        'Prefix': 'visualizations/temp/'
-                    },
-                    'Expiration': {
-                        'Days': 1
-                    }
-                }
-            ]
+    bucket_name = AWS_S3_BUCKET_NAME
+    rule = {
+        'ID': 'Expire-temp-visualizations',
+        'Status': 'Enabled',
+        'Filter': {
+            'Prefix': TEMP_VISUALIZATION_PREFIX
+        },
+        'Expiration': {
+            'Days': 1
         }
+    }
+    try:
+        # The rule is idempotent; a cheap GET avoids re-PUTting it on every boot
+        try:
+            existing_rules = s3_client.get_bucket_lifecycle_configuration(Bucket=bucket_name)['Rules']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchLifecycleConfiguration':
+                raise
+            existing_rules = []
+        
+        if any(existing.get('ID') == rule['ID'] for existing in existing_rules):
+            print(f"Lifecycle rule already set for temporary visualizations in {bucket_name}")
+            return True
         
-        # Apply the configuration to the bucket
+        # Apply the configuration to the bucket, keeping any other rules (PUT replaces them all)
         s3_client.put_bucket_lifecycle_configuration(
             Bucket=bucket_name,
-            LifecycleConfiguration=lifecycle_config
+            LifecycleConfiguration={'Rules': existing_rules + [rule]}
         )
         
         print(f"Lifecycle rule set for temporary visualizations in {bucket_name}")
         return True
     except Exception as e:
         print(f"Error setting lifecycle rule: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -3,10 +3,14 @@ from typing import List, Dict, Any, Optional
 from typing_extensions import TypedDict
 class AgentAction:
     """Action returned by agent."""
-    def __init__(self, tool: str, tool_input: Dict, log: str = ""):
+    # Fixed attribute set: no per-instance __dict__ (dataclass(slots=True) needs Python 3.10)
+    __slots__ = ("tool", "tool_input", "log", "metadata")
+    
+    def __init__(self, tool: str, tool_input: Dict, log: str = "", metadata: Optional[Dict] = None):
         self.tool = tool
         self.tool_input = tool_input
         self.log = log
+        self.metadata = metadata or {}  # Structured extras (e.g. links, visualizations)
 
 class ResearchState(TypedDict):
     """State for the Research Agent."""
@@ -14,4 +18,10 @@ class ResearchState(TypedDict):
     chat_history: List  # Conversation history
     intermediate_steps: List[AgentAction]  # Results from agent actions
     metadata_filters: Optional[Dict]  # Optional year/quarter filters
-    mode: str  # "pinecone", "web_search", "snowflake", or "combined"
\ No newline at end of file
+    mode: str  # "pinecone", "web_search", "snowflake", or "combined"
+    rag_result: str  # Pinecone search result, set by rag_search
+    web_result: str  # Formatted web search result, set by web_search
+    snowflake_result: str  # Snowflake analysis markdown, set by snowflake_search
+    web_links: List[Dict]  # {"title", "url"} for each web search result
+    visualizations: List[Dict]  # {"title", "url", "caption"} for each Snowflake chart
+    output: str  # Final answer with sources and visualizations, set by generate_final_answer
\ No newline at end of file
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The backend modules use flat imports and are normally run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# llm_service refuses to import without a Gemini key; the tests never call the API
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
@@ -0,0 +1,34 @@
+import pytest
+
+from agents.snowflake_agent import KEY_COLUMNS, project_sql
+
+KEEP = KEY_COLUMNS + ["CLOSE", "VOLUME"]
+
+
+def _selected(sql):
+    return sql.split(" FROM ")[0][len("SELECT "):].split(", ")
+
+
+def test_star_is_narrowed_to_keep_columns():
+    sql = project_sql("SELECT * FROM NVIDIA_FIN_DATA WHERE YEAR = 2024 ORDER BY DATE", KEEP)
+    assert _selected(sql) == KEEP
+    assert sql.endswith("FROM NVIDIA_FIN_DATA WHERE YEAR = 2024 ORDER BY DATE")
+
+
+def test_star_with_limit_keeps_limit():
+    sql = project_sql("SELECT * FROM NVIDIA_FIN_DATA LIMIT 5", KEEP)
+    assert _selected(sql) == KEEP
+    assert sql.endswith("LIMIT 5")
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT DATE, CLOSE FROM NVIDIA_FIN_DATA",
+    "SELECT DISTINCT DATE, CLOSE FROM NVIDIA_FIN_DATA",
+    "SELECT DISTINCT * FROM NVIDIA_FIN_DATA",
+    "SELECT YEAR, AVG(CLOSE) FROM NVIDIA_FIN_DATA GROUP BY YEAR",
+    "SELECT t.* FROM NVIDIA_FIN_DATA t",
+    "SELECT * FROM NVIDIA_FIN_DATA a JOIN OTHER b ON a.DATE = b.DATE",
+    "SELECT FROM WHERE",
+])
+def test_other_queries_are_unchanged(sql):
+    assert project_sql(sql, KEEP) == sql
@@ -0,0 +1,43 @@
+import json
+from types import SimpleNamespace
+
+from agents import snowflake_agent
+
+PLAN = {
+    "agg_sql": "SELECT AVG(CLOSE) FROM NVIDIA_FIN_DATA WHERE YEAR = 2024;",
+    "raw_sql": "SELECT * FROM NVIDIA_FIN_DATA WHERE YEAR = 2024",
+    "viz_columns": ["CLOSE"],
+}
+
+
+class _FakeModel:
+    def __init__(self, text, size):
+        self.pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        self.seen = 0
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        for piece in self.pieces:
+            self.seen += 1
+            yield SimpleNamespace(parts=[piece], text=piece)
+
+
+def _run(monkeypatch, size):
+    model = _FakeModel(json.dumps(PLAN), size)
+    monkeypatch.setattr(snowflake_agent, "_GEMINI", model)
+    dispatched = []
+
+    def on_agg_sql(sql):
+        dispatched.append((sql, model.seen))
+
+    plan = snowflake_agent.fetch_snowflake_response("average close", {"2024": ["Q1"]}, on_agg_sql=on_agg_sql)
+    return plan, dispatched, len(model.pieces)
+
+
+def test_agg_sql_is_dispatched_once_before_the_stream_ends(monkeypatch):
+    for size in (1, 3, 7, 64):
+        plan, dispatched, total = _run(monkeypatch, size)
+        assert plan["raw_sql"] == PLAN["raw_sql"]
+        assert [sql for sql, _ in dispatched] == [PLAN["agg_sql"].rstrip(";")]
+        # The aggregated query is handed off before the raw query has streamed
+        if total > 1:
+            assert dispatched[0][1] < total
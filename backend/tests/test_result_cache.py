@@ -0,0 +1,15 @@
+from research_graph import _is_cacheable
+from state import AgentAction
+
+
+def _state(*metadata):
+    return {"intermediate_steps": [AgentAction(tool="search", tool_input={}, log="", metadata=m) for m in metadata]}
+
+
+def test_clean_run_is_cached():
+    assert _is_cacheable(_state({}, {"error": False}, {"appendix": ""}))
+
+
+def test_flagged_search_is_not_cached():
+    # The text of a failed branch can look like a normal answer; only the flag counts
+    assert not _is_cacheable(_state({}, {"links": [], "error": True}, {"appendix": ""}))
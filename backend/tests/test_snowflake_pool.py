@@ -0,0 +1,47 @@
+import pytest
+import snowflake.connector
+from sqlalchemy.pool import QueuePool
+
+from agents import snowflake_agent
+
+
+class _FakeConnection:
+    opened = 0
+
+    def __init__(self, fail):
+        _FakeConnection.opened += 1
+        self.fail = fail
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        if self.fail:
+            raise snowflake.connector.errors.OperationalError("session expired")
+
+    @property
+    def description(self):
+        return [("YEAR",)]
+
+    def fetchall(self):
+        return [(2024,)]
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_connector_error_discards_the_pooled_session(monkeypatch):
+    _FakeConnection.opened = 0
+    fail = iter([True, False])
+    pool = QueuePool(lambda: _FakeConnection(next(fail)), pool_size=1, max_overflow=0)
+    monkeypatch.setattr(snowflake_agent, "_POOL", pool)
+
+    with pytest.raises(snowflake.connector.errors.OperationalError):
+        snowflake_agent.fetch_snowflake_records("SELECT YEAR FROM NVIDIA_FIN_DATA")
+
+    # The broken session is not reused; the next query gets a fresh one
+    assert snowflake_agent.fetch_snowflake_records("SELECT YEAR FROM NVIDIA_FIN_DATA") == [{"YEAR": 2024}]
+    assert _FakeConnection.opened == 2
@@ -1,10 +1,38 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime
+import os
 import re
+import time
 
 # Constants
 FASTAPI_URL = "http://34.85.173.233:8000/"  # FastAPI base URL
+# Sent by /research/stream when the research fails after the response has started
+# (matches research_graph.STREAM_ERROR_MARKER); the error message follows it
+STREAM_ERROR_MARKER = "[[STREAM_ERROR]]"
+
+# Markdown image syntax: one match per chart, and a splitter that keeps the image segments
+_IMG_RE = re.compile(r'!\[(.*?)\]\((.*?)\)')
+_IMG_SPLIT_RE = re.compile(r'(!\[.*?\]\(.*?\))')
+
+# One pooled session per Streamlit server process so repeat requests reuse the backend connection
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "styles.css")
+
+@st.cache_data
+def _load_css():
+    """Read the app stylesheet once per server process instead of on every rerun."""
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f.read()
 
 def configure_page():
     """Sets up the Streamlit page configuration."""
@@ -16,80 +44,7 @@ def configure_page():
     )
     
     # Apply custom CSS for better styling
-    st.markdown("""
-    <style>
-        .sidebar .sidebar-content {
-            background-color: #76b900;
-            background-image: linear-gradient(315deg, #76b900 0%, #1a1a1a 74%);
-            color: white;
-        }
-        .stRadio > div {
-            padding: 10px;
-            border-radius: 5px;
-            background-color: rgba(255, 255, 255, 0.1);
-        }
-        .stRadio > div:hover {
-            background-color: rgba(255, 255, 255, 0.2);
-        }
-        .stButton>button {
-            background-color: #76b900;
-            color: white;
-            font-weight: bold;
-            border-radius: 5px;
-            padding: 0.5rem 1rem;
-            border: none;
-        }
-        .stButton>button:hover {
-            background-color: #8fd400;
-        }
-        h1, h2, h3 {
-            color: #76b900;
-        }
-        .reportview-container .main .block-container {
-            padding-top: 2rem;
-        }
-        .stTextArea textarea {
-            border-radius: 5px;
-            border: 1px solid #76b900;
-        }
-        .nvidia-card {
-            background-color: #f5f5f5;
-            border-radius: 10px;
-            padding: 20px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            margin-bottom: 20px;
-        }
-        .nvidia-header {
-            color: #76b900;
-            font-weight: bold;
-        }
-        .expanded-viz {
-            background-color: #f8f9fa;
-            padding: 20px;
-            border-radius: 10px;
-            margin: 20px 0;
-            border: 1px solid #ddd;
-        }
-        
-        .download-button {
-            text-align: center;
-            margin-top: 10px;
-        }
-        
-        .download-button a {
-            background-color: #76b900;
-            color: white;
-            padding: 8px 16px;
-            border-radius: 5px;
-            text-decoration: none;
-            display: inline-block;
-        }
-        
-        .download-button a:hover {
-            background-color: #8fd400;
-        }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(f"<style>{_load_css()}</style>", unsafe_allow_html=True)
 
 def display_sidebar():
     """Displays the sidebar with logo and welcome message."""
@@ -167,9 +122,16 @@ def display_sidebar():
         user_selection = (action, years, quarters_dict)
         return user_selection
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_image(url):
+    """Download chart bytes once; reruns reuse them instead of re-fetching from S3."""
+    response = get_session().get(url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
 def display_visualization(segment, viz_index):
     """Helper function to display visualization with proper formatting"""
-    url_match = re.search(r'!\[(.*?)\]\((.*?)\)', segment)
+    url_match = _IMG_RE.search(segment)
     if url_match:
         title = url_match.group(1)
         image_url = url_match.group(2)
@@ -180,7 +142,7 @@ def display_visualization(segment, viz_index):
         with col1:
             try:
                 # Display the image
-                st.image(image_url, caption=title, use_container_width=True)
+                st.image(_fetch_image(image_url), caption=title, use_container_width=True)
             except Exception as e:
                 st.error(f"Failed to load visualization: {str(e)}")
                 st.markdown(f"[View Image Directly]({image_url})")
@@ -195,7 +157,7 @@ def display_visualization(segment, viz_index):
         # Show expanded view if state is True
         if st.session_state.get(expand_state, False):
             st.markdown("<div class='expanded-viz'>", unsafe_allow_html=True)
-            st.image(image_url, caption=f"{title} (Expanded View)", use_column_width=True)
+            st.image(_fetch_image(image_url), caption=f"{title} (Expanded View)", use_column_width=True)
             st.markdown("<div class='download-button'>", unsafe_allow_html=True)
             st.markdown(f"<a href='{image_url}' target='_blank'>📥 Download Image</a>", unsafe_allow_html=True)
             st.markdown("</div></div>", unsafe_allow_html=True)
@@ -319,39 +281,56 @@ def display_main_content(user_selection):
                 "mode": mode_mapping[action]
             }
             
-            # Display a professional loading animation
-            with st.spinner(f"Researching your query using {action} mode..."):
-                try:
-                    response = requests.post(f"{FASTAPI_URL}research", json=research_request)
-                    
+            # Stream the answer so text appears while the research is still running
+            try:
+                start_time = time.time()
+                with st.spinner(f"Researching your query using {action} mode..."):
+                    response = get_session().post(f"{FASTAPI_URL}research/stream", json=research_request, stream=True)
+                    # The headers arrive before any answer text, so keep the spinner up
+                    # through the search phase, until the first chunk is received
                     if response.status_code == 200:
-                        data = response.json()
-                        result = data.get("result", "No result received.")
-                        processing_time = data.get("processing_time", 0)
-                        
-                        # Create a results card
-                        st.markdown("""
-                        <div class="nvidia-card" style="background-color: #f9f9f9;">
-                            <h3 class="nvidia-header">Research Results</h3>
-                        """, unsafe_allow_html=True)
-                        
-                        # Display processing metrics
+                        chunks = response.iter_content(chunk_size=None, decode_unicode=True)
+                        first_chunk = next(chunks, "")
+                
+                if response.status_code == 200:
+                    # Create a results card
+                    st.markdown("""
+                    <div class="nvidia-card" style="background-color: #f9f9f9;">
+                        <h3 class="nvidia-header">Research Results</h3>
+                    """, unsafe_allow_html=True)
+                    
+                    # Processing metrics are filled in once the stream completes
+                    metrics_placeholder = st.empty()
+                    
+                    # Display result in a well-formatted container
+                    st.markdown("""
+                    <div style="background-color: white; padding: 20px; border-radius: 5px; border-left: 5px solid #76b900; margin-top: 20px;">
+                    """, unsafe_allow_html=True)
+                    
+                    result_placeholder = st.empty()
+                    result = first_chunk
+                    for chunk in chunks:
+                        result_placeholder.markdown(result.split(STREAM_ERROR_MARKER)[0] + " ▌")
+                        result += chunk
+                    result, _, stream_error = result.partition(STREAM_ERROR_MARKER)
+                    result = result.rstrip() or "No result received."
+                    if stream_error:
+                        st.error(f"❌ Research failed before the answer was complete: {stream_error.strip()}")
+                    processing_time = time.time() - start_time
+                    
+                    with metrics_placeholder.container():
                         col1, col2 = st.columns(2)
                         with col1:
                             st.success(f"✅ Results generated in {processing_time:.2f} seconds")
                         with col2:
                             current_time = datetime.now().strftime("%I:%M %p, %b %d, %Y")
                             st.info(f"🕒 Generated at: {current_time}")
-                        
-                        # Display result in a well-formatted container
-                        st.markdown("""
-                        <div style="background-color: white; padding: 20px; border-radius: 5px; border-left: 5px solid #76b900; margin-top: 20px;">
-                        """, unsafe_allow_html=True)
-                        
-                        # Enhanced visualization handling
+                    
+                    # Re-render the complete answer with enhanced visualization handling
+                    with result_placeholder.container():
                         if "![" in result and "](" in result:
                             # Split content into text and image segments
-                            segments = re.split(r'(!\[.*?\]\(.*?\))', result)
+                            segments = _IMG_SPLIT_RE.split(result)
                             
                             viz_counter = 0  # Initialize counter for unique keys
                             for segment in segments:
@@ -363,12 +342,12 @@ def display_main_content(user_selection):
                         else:
                             # If no images found, display the text as is
                             st.markdown(result)
-                        
-                        st.markdown("</div>", unsafe_allow_html=True)
-                    else:
-                        st.error(f"❌ Error: {response.status_code} - {response.text}")
-                except requests.exceptions.RequestException as e:
-                    st.error(f"❌ Failed to connect to API: {e}")
+                    
+                    st.markdown("</div>", unsafe_allow_html=True)
+                else:
+                    st.error(f"❌ Error: {response.status_code} - {response.text}")
+            except requests.exceptions.RequestException as e:
+                st.error(f"❌ Failed to connect to API: {e}")
         
 def main():
     """Main function to run the Streamlit app."""